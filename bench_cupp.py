@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""Benchmarks for cupp3.py.
+
+Run all of them with `python3 bench_cupp.py`, or only some by name, e.g.
+`python3 bench_cupp.py startup`."""
+
+import contextlib
+import io
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CUPP = os.path.join(HERE, 'cupp3.py')
+
+# Cold start targets (median seconds) for `cupp3.py -v` and for reaching the
+# first question of `cupp3.py -i`.
+STARTUP_TARGETS = {'-v': 0.10, '-i': 0.10}
+
+
+def timed_run(args, runs):
+    """Median wall time of running cupp3.py with the given arguments."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        # stdin is closed, so -i stops at its first question
+        subprocess.run([sys.executable, CUPP, '-q'] + args, cwd=HERE,
+                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def timed_run_python(runs):
+    """Median wall time of an empty interpreter, for reference."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'])
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def bench_startup(runs=15):
+    """Cold start of -v and -i against STARTUP_TARGETS."""
+    ok = True
+    baseline = timed_run_python(runs)
+    print("  %-16s %.3fs" % ('python -c pass', baseline))
+    for option, target in sorted(STARTUP_TARGETS.items()):
+        elapsed = timed_run([option], runs)
+        ok &= elapsed <= target
+        print("  %-16s %.3fs (target %.3fs)%s"
+              % ('cupp3.py ' + option, elapsed, target,
+                 '' if elapsed <= target else ' FAILED'))
+    return ok
+
+
+# A profile answering every question, with all the suffix tables enabled.
+FULL_PROFILE = dict(name='john', surname='smith', nick='johnny',
+                    birthdate='12031985', wife='jane', wifen='janie',
+                    wifeb='05061987', kid='tom', kidn='tommy',
+                    kidb='01022010', pet='rex', company='acme',
+                    words=['hacker', 'linux', 'blue'], spechars=True,
+                    randnum=True, leetmode=True)
+
+
+class WordTrie:
+    """Radix tree of words, the candidate store measured against WordArena
+    by bench_dedup(). A node maps the first character of each edge to the
+    edge label, for a leaf, or to a (label, node) pair; '' marks a word
+    ending at the node. Duplicates are dropped on insert and a traversal
+    yields the words sorted."""
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, word):
+        node = self._root
+        while word:
+            head = word[0]
+            child = node.get(head)
+            if child is None:
+                node[head] = word
+                return
+            label, sub = (child, None) if isinstance(child, str) else child
+            common = os.path.commonprefix([label, word])
+            if sub is not None and common == label:
+                node, word = sub, word[len(label):]
+                continue
+            if common == label == word:
+                return
+            rest = label[len(common):]
+            split = {rest[:1]: rest if sub is None else (rest, sub)}
+            node[head] = (common, split)
+            node, word = split, word[len(common):]
+        node[''] = ''
+
+    def __iter__(self):
+        return self._walk('', self._root)
+
+    def _walk(self, prefix, node):
+        for key in sorted(node):
+            child = node[key]
+            if isinstance(child, str):
+                yield prefix + child
+            else:
+                yield from self._walk(prefix + child[0], child[1])
+
+
+def profile_words():
+    """The candidates of FULL_PROFILE and their leet forms, as generated
+    before the final sort."""
+    sys.path.insert(0, HERE)
+    import cupp3
+    cupp3.read_config(os.path.join(HERE, 'cupp.cfg'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        words = cupp3.profile_candidates(cupp3.profile_pools(FULL_PROFILE))
+    return list(words) + [cupp3.leet_replace(word) for word in words]
+
+
+def dedup_sorted(words):
+    return sorted(set(words))
+
+
+def dedup_arena(words):
+    from cupp3 import WordArena
+    arena = WordArena(words)
+    arena.sort(unique=True)
+    return arena
+
+
+def dedup_trie(words):
+    trie = WordTrie()
+    for word in words:
+        trie.add(word)
+    return trie
+
+
+def bench_dedup(runs=3):
+    """Time, peak memory and memory held by the sorted, unique store of
+    the candidates of a full profile: set and sorted list, arena, trie.
+    The candidates are decoded afresh for every store, so that each one
+    owns its words as the generation stages would hand them over."""
+    encoded = [word.encode() for word in profile_words()]
+    expected = sorted(set(encoded))
+    print("  %i candidates, %i unique" % (len(encoded), len(expected)))
+    expected = [word.decode() for word in expected]
+    for name, dedup in (('set+sorted', dedup_sorted), ('arena', dedup_arena),
+                        ('trie', dedup_trie)):
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            store = dedup(word.decode() for word in encoded)
+            times.append(time.perf_counter() - start)
+            assert list(store) == expected, name
+            del store
+        tracemalloc.start()
+        store = dedup(word.decode() for word in encoded)
+        held, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del store
+        print("  %-12s %.3fs  peak %5.1f MB  held %5.1f MB"
+              % (name, statistics.median(times), peak / 1e6, held / 1e6))
+
+
+def bench_products(runs=3):
+    """A million-row prefix x suffix product, then the whole -i pipeline of
+    a large profile with leet, with the Python and the NumPy backends."""
+    sys.path.insert(0, HERE)
+    import cupp3
+    cupp3.read_config(os.path.join(HERE, 'cupp.cfg'))
+    try:
+        import numpy
+    except ImportError:
+        print("  NumPy is not installed, skipped")
+        return
+    prefixes = ['word%i' % i for i in range(1000)]
+    suffixes = [str(i) for i in range(1000)]
+    for name, product in (('komb', lambda: list(cupp3.komb(prefixes, suffixes))),
+                          ('numpy_product', lambda: cupp3.numpy_product(
+                              numpy, prefixes, suffixes))):
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            product()
+            times.append(time.perf_counter() - start)
+        print("  %-14s %.3fs" % (name, statistics.median(times)))
+
+    profile = dict(FULL_PROFILE, words=['word%i' % i for i in range(100)])
+    pools = cupp3.profile_pools(profile)
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in ('python', 'numpy'):
+            times = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    words = cupp3.profile_candidates(pools, True, 1, backend)
+                    count = cupp3.finish_wordlist(os.path.join(tmp, backend),
+                                                  words, True)
+                times.append(time.perf_counter() - start)
+            print("  %-14s %.3fs  %i words" % ('-i ' + backend,
+                                               statistics.median(times), count))
+
+
+BENCHMARKS = {
+    'dedup': bench_dedup,
+    'products': bench_products,
+    'startup': bench_startup,
+}
+
+
+def main():
+    names = sys.argv[1:] or sorted(BENCHMARKS)
+    ok = True
+    for name in names:
+        print("[+] %s" % name)
+        ok &= BENCHMARKS[name]() is not False
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -86,16 +86,29 @@ def komb(seq, start, special = ""):
 			yield mystr + special + mystr1
 
 # print list to file counting words
+# (written in chunks to a temporary file, renamed when complete)
 
-def print_to_file(filename, unique_list_finished):
-	f = open ( filename, 'w' )
+def print_to_file(filename, unique_list_finished, chunk = 100000):
 	unique_list_finished.sort()
-	f.write (os.linesep.join(unique_list_finished))
-	f = open ( filename, 'r' )
+	tmpname = filename + '.tmp'
+	f = open ( tmpname, 'w' )
 	lines = 0
-	for line in f:
-		lines += 1
-	f.close()
+	try:
+		for start in xrange(0, len(unique_list_finished), chunk):
+			words = unique_list_finished[start:start+chunk]
+			if lines:
+				f.write (os.linesep)
+			f.write (os.linesep.join(words))
+			lines += len(words)
+		f.close()
+		# os.rename() does not replace an existing file on Windows
+		if os.path.exists(filename):
+			os.remove(filename)
+		os.rename(tmpname, filename)
+	finally:
+		f.close()
+		if os.path.exists(tmpname):
+			os.remove(tmpname)
 	print "[+] Saving dictionary to \033[1;31m"+filename+"\033[1;m, counting \033[1;31m"+str(lines)+" words.\033[1;m"
 	print "[+] Now load your pistolero with \033[1;31m"+filename+"\033[1;m and shoot! Good luck!"
 
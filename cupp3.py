@@ -11,15 +11,20 @@ __author__ = 'Muris Kurgas'
 __license__ = 'GPL'
 __version__ = '3.1.0-alpha'
 
+# Only light modules are imported here; the network stack, configparser,
+# csv/gzip and the profiling modules are imported by the functions that need
+# them, so that -v and -i start quickly.
 import argparse
-import configparser
-import csv
-import ftplib
+import collections
+import collections.abc
+import contextlib
+import contextvars
 import functools
-import gzip
+import itertools
 import os
+import re
 import sys
-from urllib.request import urlopen
+import time
 
 try:
     import readline
@@ -36,29 +41,160 @@ COW_BANNER = """ ___________
 
 
 """
-CONFIG = {}
-FTP_CONFIG = {}
-LEET_CONFIG = {}
+
+
+class Config(collections.abc.Mapping):
+    """Immutable settings of a generation, as returned by load_config().
+    Nested sections (leet, ftp, cases) are Configs too. Use replace() to
+    derive a config with other settings."""
+    __slots__ = ('_items',)
+
+    def __init__(self, items=(), **changes):
+        object.__setattr__(self, '_items', dict(items, **changes))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Config is immutable, use replace()")
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return 'Config(%r)' % self._items
+
+    def __reduce__(self):
+        return Config, (self._items,)
+
+    def replace(self, **changes):
+        """Return a copy of this config with the given settings changed."""
+        return Config(self._items, **changes)
+
+
+# The config in use, set by read_config() or use_config(). Being a context
+# variable, every thread and every asyncio task can use its own.
+CURRENT_CONFIG = contextvars.ContextVar('cupp_config')
+
+
+def use_config(config):
+    """Make config the config in use in the current context."""
+    CURRENT_CONFIG.set(config)
+
+
+def current_config():
+    """Return the config in use in the current context."""
+    try:
+        return CURRENT_CONFIG.get()
+    except LookupError:
+        raise LookupError("No config in use: call read_config() or use_config(),"
+                          " or generate with a Profiler") from None
+
+
+class ConfigView(collections.abc.Mapping):
+    """Read-only view of the config in use, or of one of its sections."""
+
+    def __init__(self, section=None):
+        self._section = section
+
+    def _config(self):
+        config = current_config()
+        return config if self._section is None else config[self._section]
+
+    def __getitem__(self, key):
+        return self._config()[key]
+
+    def __iter__(self):
+        return iter(self._config())
+
+    def __len__(self):
+        return len(self._config())
+
+
+CONFIG = ConfigView()
+FTP_CONFIG = ConfigView('ftp')
+LEET_CONFIG = ConfigView('leet')
+# Per-stage timings of the current run, filled in only with --profile
+PROFILE = {'enabled': False, 'stages': [], 'stats': False, 'yield': []}
 
 def main():
     """Command-line interface to the cupp utility"""
 
-    args = get_parser().parse_args()
-
-    read_config()
+    parser = get_parser()
+    args = parser.parse_args()
+    if args.jobs < 0:
+        parser.error('--jobs cannot be negative (0: one per CPU)')
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.split_lines < 0 or args.split_size < 0:
+        parser.error('--split-lines and --split-size cannot be negative')
+    if args.serve:
+        if args.profile or args.stats or args.cprofile:
+            parser.error('--profile, --stats and --cprofile cannot be used with --serve')
+        try:
+            parse_address(args.serve)
+        except ValueError as err:
+            parser.error('--serve: %s' % err)
+    split = None
+    if args.split_lines or args.split_size:
+        if args.cache or args.incremental:
+            parser.error('--split-lines and --split-size cannot be used with'
+                         ' --cache or --incremental')
+        split = Split(args.split_lines, int(args.split_size * (1 << 20)) or None,
+                      args.workers)
+
+    if not args.version:
+        read_config()
     if not args.quiet:
         print(COW_BANNER)
 
+    profiler = None
+    if args.profile or args.cprofile or args.stats:
+        start_profiling(args.stats)
+        if args.cprofile:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+    cache = None
+    if args.cache:
+        cache = WordlistCache(args.cache, int(args.cache_size * (1 << 20)))
+
+    output = None
     if args.version:
         version()
     elif args.interactive:
-        interactive()
+        output = interactive(args.rules, args.incremental, args.exclude,
+                             args.jobs, 'numpy' if args.numpy else 'python', cache,
+                             split, args.query)
     elif args.download_wordlist:
         download_wordlist()
     elif args.alecto:
         alectodb_download()
     elif args.improve:
-        improve_dictionary(args.improve)
+        output = improve_dictionary(args.improve, args.rules, args.exclude, cache,
+                                    args.jobs, split)
+    elif args.serve:
+        serve(args.serve, args.workers)
+    else:
+        operation = ('union' if args.union else
+                     'intersect' if args.intersect else 'diff')
+        filenames = args.union or args.intersect or args.diff
+        output = combine_wordlists(operation, filenames,
+                                   args.output or operation + '.txt')
+
+    if profiler is not None:
+        profiler.disable()
+        if output:
+            profiler.dump_stats(output + '.pstats')
+            print("[+] cProfile stats saved to %s.pstats" % output)
+    if (args.profile or args.cprofile) and output:
+        report_profile(output)
+    if args.stats and output:
+        report_stats(output)
 
 
 # Separate into a function for testing purposes
@@ -81,8 +217,72 @@ def get_parser():
                        ' and enhanced')
     group.add_argument('-v', '--version', action='store_true',
                        help='version of this program')
+    group.add_argument('--serve', metavar='[HOST:]PORT',
+                       help='Serve -i and -w jobs posted as JSON over HTTP,'
+                       ' streaming the words back')
+    group.add_argument('--union', metavar='FILENAME', nargs='+',
+                       help='Merge wordlists into one sorted list without'
+                       ' duplicates')
+    group.add_argument('--intersect', metavar='FILENAME', nargs='+',
+                       help='Keep the words found in all the wordlists')
+    group.add_argument('--diff', metavar='FILENAME', nargs='+',
+                       help='Keep the words of the first wordlist found in'
+                       ' none of the others')
+    parser.add_argument('-o', '--output', metavar='FILENAME',
+                        help='Output of --union, --intersect and --diff'
+                        ' (default: <operation>.txt)')
     parser.add_argument('-q', '--quiet', action='store_true',
                         help="Quiet mode (don't print banner)")
+    parser.add_argument('--rules', action='store_true',
+                        help='With -i or -w, only write the base words plus a'
+                        ' hashcat/John rule file and a hashcat mask file that'
+                        ' add the years, numbers, special chars and leet')
+    parser.add_argument('--incremental', action='store_true',
+                        help='With -i, remember the profile; re-running it'
+                        ' with new facts only appends the new words to'
+                        ' <name>.delta.txt')
+    parser.add_argument('--exclude', metavar='FILENAME', nargs='+', default=[],
+                        help='With -i or -w, leave out the words of these'
+                        ' wordlists (e.g. lists already tried). They must be'
+                        ' sorted bytewise (LC_ALL=C sort) and may be gzipped')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=1,
+                        help='With -i, run the generation stages in N worker'
+                        ' processes (0: one per CPU); with -w, the leet mode')
+    parser.add_argument('--workers', metavar='N', type=int, default=4,
+                        help='With --serve, how many jobs run at a time; with'
+                        ' --split-lines or --split-size, how many parts are'
+                        ' written at a time (default: 4)')
+    parser.add_argument('--query', metavar='FILENAME',
+                        help='With -i, make no wordlist but tell for each'
+                        ' password of FILENAME (one per line) whether the'
+                        ' wordlist would hold it, and which stage makes it')
+    parser.add_argument('--split-lines', metavar='N', type=int, default=0,
+                        help='With -i or -w, write the words to numbered parts'
+                        ' of at most N lines, <output>.0001.txt and so on')
+    parser.add_argument('--split-size', metavar='MB', type=float, default=0,
+                        help='With -i or -w, write the words to numbered parts'
+                        ' of at most MB megabytes')
+    parser.add_argument('--numpy', action='store_true',
+                        help='With -i, build the products with NumPy, if it'
+                        ' is installed')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='With -i or -w, keep the wordlists made in DIR and'
+                        ' copy them from there when the same profile or'
+                        ' wordlist, config and options come again')
+    parser.add_argument('--cache-size', metavar='MB', type=float, default=1024,
+                        help='Size of the --cache directory, beyond which the'
+                        ' least recently used wordlists are removed'
+                        ' (default: 1024)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print per-stage wall/CPU time and peak memory'
+                        ' and save them to <output>.profile.json')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print how many words (and unique, in-length'
+                        ' words) each stage yields and save them, with length'
+                        ' histograms, to <output>.stats.json')
+    parser.add_argument('--cprofile', action='store_true',
+                        help='Like --profile, and also dump cProfile stats'
+                        ' to <output>.pstats')
 
     return parser
 
@@ -97,15 +297,22 @@ def version():
 
 
 def read_config(filename='cupp.cfg'):
-    """Read the given configuration file and update global variables to reflect
-    changes (CONFIG, FTP_CONFIG, LEET_CONFIG)."""
-    #global CONFIG, FTP_CONFIG, LEET_CONFIG
+    """Read the given configuration file and use it (see load_config() and
+    use_config()) in the current context, which CONFIG, FTP_CONFIG and
+    LEET_CONFIG reflect."""
+    use_config(load_config(filename))
+
+
+def load_config(filename='cupp.cfg'):
+    """Read the given configuration file and return it as a Config, with the
+    generation plans and the suffix tables compiled."""
+    import configparser
 
     # Reading configuration file
     config = configparser.ConfigParser()
     config.read(filename)
 
-    CONFIG.update({
+    settings = {
         'years':     config.get('years', 'years').split(','),
         'chars':     config.get('specialchars', 'chars').split(','),
 
@@ -117,25 +324,746 @@ def read_config(filename='cupp.cfg'):
 
         'threshold': config.getint('nums', 'threshold'),
         'alectourl': config.get('alecto', 'alectourl')
+    }
+
+    settings['dateformats'] = tuple(
+        fmt for fmt in config.get('dates', 'formats', fallback='').split(',') if fmt)
+
+    settings['chardepth'] = config.getint('specialchars', 'depth', fallback=3)
+
+    def names_in(section, option):
+        return tuple(name.strip() for name in config.get(section, option, fallback='').split(',')
+                     if name.strip())
+    settings['cases'] = Config(
+        fields=names_in('cases', 'fields'),
+        variants=names_in('cases', 'variants'),
+        budget=config.getint('cases', 'budget', fallback=4),
+    )
+    unknown = [field for field in settings['cases']['fields'] if field not in CASE_FIELDS]
+    unknown += [name for name in settings['cases']['variants'] if name not in CASE_VARIANTS]
+    if unknown:
+        raise ValueError("Unknown %s in [cases]" % ', '.join(unknown))
+
+    settings['policy'] = compile_policy(
+        config.getint('policy', 'minlength', fallback=0),
+        config.getint('policy', 'maxlength', fallback=0),
+        names_in('policy', 'require'), config.get('policy', 'charset', fallback=''))
+
+    # Generation plans, compiled once
+    def plan_specs(section, default):
+        return config.items(section) if config.has_section(section) else default
+    settings['plan'] = compile_plan(plan_specs('plan', DEFAULT_PLAN), PROFILE_POOLS)
+    settings['wordlist_plan'] = compile_plan(
+        plan_specs('wordlist plan', DEFAULT_WORDLIST_PLAN), WORDLIST_POOLS)
+
+    settings['numpadding'] = config.getint('nums', 'padding', fallback=0)
+
+    # Suffix tables, compiled once here and shared by every stage
+    settings.update({
+        'years':    suffix_table(settings['years']),
+        'chars':    tuple(settings['chars']),
+        'numbers':  number_table(settings['numfrom'], settings['numto'],
+                                 settings['numpadding']),
+        'spechars': spechar_table(settings['chars'], settings['chardepth']),
     })
 
     # 1337 mode configs, well you can add more lines if you add it to the
     # config file too.
     leet = functools.partial(config.get, 'leet')
-    LEET_CONFIG.update(dict(a=leet('a'), e=leet('e'), g=leet('g'), i=leet('i'),
-                            o=leet('o'), s=leet('s'), t=leet('t'), z=leet('z')))
+    settings['leet'] = Config(a=leet('a'), e=leet('e'), g=leet('g'), i=leet('i'),
+                              o=leet('o'), s=leet('s'), t=leet('t'), z=leet('z'))
 
     ftp_config = functools.partial(config.get, 'downloader')
-    FTP_CONFIG.update(dict(name=ftp_config('ftpname'),
-                           url=ftp_config('ftpurl'),
-                           path=ftp_config('ftppath'),
-                           user=ftp_config('ftpuser'),
-                           password=ftp_config('ftppass')))
+    settings['ftp'] = Config(name=ftp_config('ftpname'),
+                             url=ftp_config('ftpurl'),
+                             path=ftp_config('ftppath'),
+                             user=ftp_config('ftpuser'),
+                             password=ftp_config('ftppass'))
+    return Config(settings)
+
+
+def suffix_table(suffixes):
+    """Return the given suffixes as an immutable table of interned strings."""
+    return tuple(sys.intern(s) for s in suffixes)
+
+
+def number_table(start, stop, padding=0):
+    """Compile the numbers in range(start, stop) as strings. With padding,
+    zero-padded forms up to that width are added as well (7 -> 07, 007)."""
+    numbers = [str(num) for num in range(start, stop)]
+    for width in range(2, padding + 1):
+        numbers.extend(str(num).zfill(width) for num in range(start, stop)
+                       if len(str(num)) < width)
+    return suffix_table(numbers)
+
+
+def spechar_table(chars, depth=3):
+    """Compile all products of the special chars up to the given depth
+    (!, !!, !@#, ...)."""
+    return suffix_table(''.join(p) for n in range(1, depth + 1)
+                        for p in itertools.product(chars, repeat=n))
+
+
+def start_profiling(stats=False):
+    """Enable per-stage profiling (the --profile switch) for this run, and
+    the per-stage yield statistics too with stats (the --stats switch)."""
+    import tracemalloc
+    PROFILE.update({'enabled': True, 'stages': [], 'stats': stats, 'yield': []})
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+@contextlib.contextmanager
+def profile_stage(name):
+    """Record wall time, CPU time and peak traced memory of the enclosed block
+    under the given stage name. Does nothing unless profiling is enabled."""
+    if not PROFILE['enabled']:
+        yield
+        return
+
+    import tracemalloc
+    tracemalloc.reset_peak()
+    mem_start = tracemalloc.get_traced_memory()[0]
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        PROFILE['stages'].append({
+            'stage': name,
+            'wall': time.perf_counter() - wall,
+            'cpu': time.process_time() - cpu,
+            'peak': max(tracemalloc.get_traced_memory()[1] - mem_start, 0),
+        })
+
+
+def profiled(name, iterable):
+    """Materialize the given iterable as a list inside profile_stage(name)."""
+    with profile_stage(name):
+        return list(iterable)
+
+
+# A password policy: length limits (0: none), the character classes every word
+# must have and the only characters allowed (None: any)
+Policy = collections.namedtuple('Policy', 'minlength maxlength classes charset')
+
+CHAR_CLASSES = {
+    'lower': str.islower,
+    'upper': str.isupper,
+    'digit': str.isdigit,
+    'special': lambda c: not c.isalnum(),
+}
+
+
+def compile_policy(minlength=0, maxlength=0, classes=(), charset=''):
+    """Compile the [policy] settings into a Policy, or None if they set no
+    rule."""
+    unknown = [name for name in classes if name not in CHAR_CLASSES]
+    if unknown:
+        raise ValueError("Unknown %s in [policy]" % ', '.join(unknown))
+    if not (minlength or maxlength or classes or charset):
+        return None
+    return Policy(minlength, maxlength, frozenset(classes), frozenset(charset) or None)
+
+
+def char_classes(word):
+    """Return the set of the character classes (see CHAR_CLASSES) of word."""
+    return frozenset(name for name, test in CHAR_CLASSES.items() if any(map(test, word)))
+
+
+def length_range():
+    """Return the lowest and highest word lengths allowed by the word
+    length limits and the password policy."""
+    low, high = CONFIG['wcfrom'] + 1, CONFIG['wcto'] - 1
+    policy = CONFIG['policy']
+    if policy is not None:
+        low = max(low, policy.minlength)
+        high = min(high, policy.maxlength or high)
+    return low, high
+
+
+def word_filter():
+    """Return a predicate telling whether a word is within the word length
+    limits and matches the password policy."""
+    low, high = length_range()
+    policy = CONFIG['policy']
+    if policy is None:
+        return lambda word: low <= len(word) <= high
+
+    def accept(word):
+        return (low <= len(word) <= high and policy.classes <= char_classes(word)
+                and (policy.charset is None or policy.charset.issuperset(word)))
+    return accept
+
+
+def policy_komb(seq, start, leetmode=False):
+    """komb() for a password policy: skip the products that could match it
+    neither as they are nor in leet (with leetmode), judging from what the
+    prefix and the suffix bring. Suffixes are grouped by character classes
+    and length, so that a prefix is checked once per group."""
+    policy = CONFIG['policy']
+    low, high = length_range()
+    if leetmode and any(len(c) != len(n) for c, n in LEET_CONFIG.items()):
+        # Leet versions may have other lengths, leave it to word_filter()
+        low, high = 0, float('inf')
+
+    def traits(token):
+        forms = (token, leet_replace(token)) if leetmode else (token,)
+        allowed = policy.charset is None or any(map(policy.charset.issuperset, forms))
+        return frozenset().union(*map(char_classes, forms)), allowed
+
+    groups = collections.defaultdict(list)
+    for suffix in start:
+        classes, allowed = traits(suffix)
+        if allowed:
+            groups[classes, len(suffix)].append(suffix)
+
+    for prefix in seq:
+        classes, allowed = traits(prefix)
+        if not allowed:
+            continue
+        need = policy.classes - classes
+        for (suffix_classes, length), group in groups.items():
+            if need <= suffix_classes and low <= len(prefix) + length <= high:
+                for suffix in group:
+                    yield prefix + suffix
+
+
+def product(seq, start, leetmode=False):
+    """The products of a plan stage: komb(), or policy_komb() when a
+    password policy is set."""
+    if CONFIG['policy'] is None:
+        return komb(seq, start)
+    return policy_komb(seq, start, leetmode)
+
+
+# A stage of a generation plan: the words of the prefixes pool, or their
+# products with the words of the suffixes pool, through the transforms
+Stage = collections.namedtuple('Stage', 'name prefixes suffixes transforms')
+
+TRANSFORMS = {
+    'lower': str.lower,
+    'upper': str.upper,
+    'title': str.title,
+    'reverse': lambda s: s[::-1],
+    'leet': lambda s: leet_replace(s),
+}
+
+# Case variants of the [cases] profile fields, besides their lower and title
+# forms: token -> iterable of forms, given the other tokens of those fields
+CASE_VARIANTS = {
+    'upper': lambda token, others: [token.upper()],
+    'toggle': lambda token, others: [token.title().swapcase()],
+    'alternate': lambda token, others: [''.join(
+        c.upper() if i % 2 == 0 else c.lower() for i, c in enumerate(token))],
+    'camel': lambda token, others: (token.lower() + other.title() for other in others),
+}
+CASE_FIELDS = ('name', 'surname', 'nick', 'wife', 'wifen', 'kid', 'kidn', 'pet',
+               'company', 'words')
+
+# Built-in generation plans, used when cupp.cfg has no [plan] or
+# [wordlist plan] section. See cupp.cfg for the syntax.
+DEFAULT_PLAN = (
+    ('komb1', 'kombinaa x bdss'),
+    ('komb2', 'kombinaaw x wbdss'),
+    ('komb3', 'kombinaak x kbdss'),
+    ('komb4', 'kombinaa x years'),
+    ('komb5', 'kombinaac x years'),
+    ('komb6', 'kombinaaw x years'),
+    ('komb7', 'kombinaak x years'),
+    ('komb8', 'word x bdss'),
+    ('komb9', 'word x wbdss'),
+    ('komb10', 'word x kbdss'),
+    ('komb11', 'word x years'),
+    ('komb12', 'word x numbers'),
+    ('komb13', 'kombinaa x numbers'),
+    ('komb14', 'kombinaac x numbers'),
+    ('komb15', 'kombinaaw x numbers'),
+    ('komb16', 'kombinaak x numbers'),
+    ('komb21', 'reverse x numbers'),
+    ('komb17', 'reverse x years'),
+    ('komb18', 'rev_w x wbdss'),
+    ('komb19', 'rev_k x kbdss'),
+    ('komb20', 'rev_n x bdss'),
+    ('komb001', 'kombinaa x spechars'),
+    ('komb002', 'kombinaac x spechars'),
+    ('komb003', 'kombinaaw x spechars'),
+    ('komb004', 'kombinaak x spechars'),
+    ('komb005', 'word x spechars'),
+    ('komb006', 'reverse x spechars'),
+    ('kombcase1', 'cases x years'),
+    ('kombcase2', 'cases x numbers'),
+    ('kombcase3', 'cases x spechars'),
+    ('kombinaa', 'kombinaa'),
+    ('kombinaac', 'kombinaac'),
+    ('kombinaaw', 'kombinaaw'),
+    ('kombinaak', 'kombinaak'),
+    ('word', 'word'),
+    ('bdss', 'bdss'),
+    ('wbdss', 'wbdss'),
+    ('kbdss', 'kbdss'),
+    ('reverse', 'reverse'),
+    ('cases', 'cases'),
+)
+DEFAULT_WORDLIST_PLAN = (
+    ('kombinacija1', 'listica x years'),
+    ('kombinacija2', 'cont x years'),
+    ('kombinacija3', 'listica x spechars'),
+    ('kombinacija4', 'cont x spechars'),
+    ('kombinacija5', 'listica x numbers'),
+    ('kombinacija6', 'cont x numbers'),
+    ('listica', 'listica'),
+    ('cont', 'cont'),
+)
+# Pools the plans can refer to, see profile_pools() and improve_dictionary()
+PROFILE_POOLS = ('kombinaa', 'kombinaac', 'kombinaaw', 'kombinaak', 'word',
+                 'reverse', 'rev_n', 'rev_w', 'rev_k', 'bdss', 'wbdss', 'kbdss',
+                 'cases', 'years', 'numbers', 'spechars')
+WORDLIST_POOLS = ('listica', 'cont', 'years', 'numbers', 'spechars')
+
+
+def compile_plan(specs, pools):
+    """Compile the (stage name, spec) pairs of a plan into a tuple of the
+    enabled Stages. A spec reads `[on|off] prefixes [x suffixes] [| transform
+    ...]`, where prefixes and suffixes are names of pools."""
+    plan = []
+    for name, spec in specs:
+        head, *transforms = [part.strip() for part in spec.split('|')]
+        words = head.split()
+        enabled = True
+        if words and words[0] in ('on', 'off'):
+            enabled = words.pop(0) == 'on'
+
+        if len(words) == 1:
+            prefixes, suffixes = words[0], None
+        elif len(words) == 3 and words[1] == 'x':
+            prefixes, suffixes = words[0], words[2]
+        else:
+            raise ValueError("Invalid stage %s = %s" % (name, spec))
+        unknown = [pool for pool in (prefixes, suffixes)
+                   if pool is not None and pool not in pools]
+        unknown += [t for t in transforms if t not in TRANSFORMS]
+        if unknown:
+            raise ValueError("Unknown %s in stage %s = %s"
+                             % (', '.join(unknown), name, spec))
+
+        if enabled:
+            plan.append(Stage(name, prefixes, suffixes, tuple(transforms)))
+    return tuple(plan)
+
+
+def transform_words(stage, words):
+    """Apply the transforms of a plan stage to the given words."""
+    for transform in stage.transforms:
+        words = map(TRANSFORMS[transform], words)
+    return words
+
+
+def run_plan(plan, pools, leetmode=False):
+    """Run the stages of a compiled plan over the given pools, and return
+    the (stage name, words) pairs. Products that cannot match the password
+    policy, even in leet with leetmode, are skipped."""
+    stages = []
+    for stage in plan:
+        if stage.suffixes is None:
+            words = pools[stage.prefixes]
+        elif stage.transforms:
+            words = komb(pools[stage.prefixes], pools[stage.suffixes])
+        else:
+            words = product(pools[stage.prefixes], pools[stage.suffixes], leetmode)
+        stages.append((stage.name, profiled(stage.name, transform_words(stage, words))))
+    return stages
+
+
+def merge_stages(stages):
+    """Return the set of all the words of the given (stage name, words)
+    pairs. With --stats, also record how many words each stage yields, how
+    many of them no earlier stage yielded, and the lengths of those."""
+    with profile_stage('dedup'):
+        if not PROFILE['stats']:
+            # The token pools are canonical, so the stages rarely overlap and
+            # a single set is enough to drop the few duplicates left
+            return set(itertools.chain.from_iterable(words for _, words in stages))
+
+        uniqset = set()
+        for name, words in stages:
+            fresh = set(words) - uniqset
+            uniqset |= fresh
+            lengths = collections.Counter(map(len, fresh))
+            PROFILE['yield'].append({
+                'stage': name,
+                'raw': len(words),
+                'unique': len(fresh),
+                'in_length': sum(map(word_filter(), fresh)),
+                'lengths': dict(sorted(lengths.items())),
+            })
+        return uniqset
+
+
+def plan_tasks(plan, pools, size=50000):
+    """Split the stages of a compiled plan into (stage, prefixes, suffixes)
+    tasks of about size words, slicing the larger pool of each product."""
+    for stage in plan:
+        prefixes = pools[stage.prefixes]
+        if stage.suffixes is None:
+            yield stage, prefixes, None
+            continue
+        suffixes = pools[stage.suffixes]
+        parts = max(1, min(len(prefixes) * len(suffixes) // size,
+                           max(len(prefixes), len(suffixes))))
+        for part in range(parts):
+            if len(suffixes) > len(prefixes):
+                yield stage, prefixes, suffixes[part::parts]
+            else:
+                yield stage, prefixes[part::parts], suffixes
+
+
+def plan_task(task):
+    """Worker of run_plan_parallel(): run one task of plan_tasks(), add the
+    leet versions if asked, keep the words within the length limits and
+    matching the password policy, and return them sorted and without
+    duplicates as newline-terminated UTF-8 bytes."""
+    stage, prefixes, suffixes, leetmode = task
+    if suffixes is None:
+        words = prefixes
+    elif stage.transforms:
+        words = komb(prefixes, suffixes)
+    else:
+        words = product(prefixes, suffixes, leetmode)
+    words = set(transform_words(stage, words))
+    if leetmode:
+        words.update(map(leet_replacer(), list(words)))
+    words = sorted(word.encode() for word in filter(word_filter(), words))
+    return b''.join(word + b'\n' for word in words)
+
+
+def _init_worker(config):
+    use_config(config)
+
+
+def run_plan_parallel(plan, pools, leetmode, jobs=None):
+    """Run the stages of a compiled plan over the given pools in jobs worker
+    processes (one per CPU by default). Each task returns a sorted run of
+    unique words, with their leet versions if asked and within the word
+    length limits; the runs are gathered in a WordArena that merges them,
+    dropping duplicates, when iterated."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    tasks = [task + (leetmode,) for task in plan_tasks(plan, pools)]
+    arena = WordArena()
+    with profile_stage('plan'), ProcessPoolExecutor(
+            jobs, initializer=_init_worker, initargs=(current_config(),)) as executor:
+        for run in executor.map(plan_task, tasks):
+            arena.add_run(run)
+    return arena
+
+
+def numpy_candidates(plan, pools, leetmode):
+    """NumPy backend of profile_candidates(): build the products of the plan
+    stages as fixed-width byte arrays, add their leet versions if asked,
+    shape them by length and drop the duplicates. Return a WordArena holding
+    them as one sorted run, or None when NumPy is not installed, some token
+    is not ASCII (bytes must be characters) or a password policy is set."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    tokens = itertools.chain(LEET_CONFIG, LEET_CONFIG.values(),
+                             itertools.chain.from_iterable(pools.values()))
+    if not all(token.isascii() for token in tokens) or CONFIG['policy'] is not None:
+        return None
+
+    wcfrom, wcto = CONFIG['wcfrom'], CONFIG['wcto']
+    # Leet versions keep the length of their words unless some replacement
+    # changes it; only then must the length limits wait for the leet stage
+    limits = (wcfrom, wcto) if not leetmode or all(
+        len(c) == len(n) for c, n in LEET_CONFIG.items()) else None
+    parts = []
+    with profile_stage('products'):
+        for stage in plan:
+            if stage.suffixes is None or stage.transforms:
+                words = pools[stage.prefixes] if stage.suffixes is None else \
+                    komb(pools[stage.prefixes], pools[stage.suffixes])
+                words = [word.encode() for word in transform_words(stage, words)]
+                parts.append(numpy.array(words, dtype='S'))
+            else:
+                parts.append(numpy_product(numpy, pools[stage.prefixes],
+                                           pools[stage.suffixes], limits))
+        words = numpy_unique(numpy, numpy.concatenate(parts))
+
+    with profile_stage('filter'):
+        if leetmode:
+            leet = words
+            for c, n in LEET_CONFIG.items():
+                leet = numpy.char.replace(leet, c.encode(), n.encode())
+            words = numpy.concatenate([words, leet])
+        lengths = numpy.char.str_len(words)
+        words = words[(wcfrom < lengths) & (lengths < wcto)]
+    with profile_stage('sort'):
+        words = numpy_unique(numpy, words)
+
+    # One word per line: a newline right after the last byte of every word,
+    # then the padding dropped
+    width = words.dtype.itemsize
+    lines = numpy.zeros((len(words), width + 1), numpy.uint8)
+    lines[:, :width] = words.view(numpy.uint8).reshape(len(words), width)
+    lines[numpy.arange(len(words)), numpy.char.str_len(words)] = ord('\n')
+    arena = WordArena()
+    arena.add_run(lines[lines != 0].tobytes())
+    return arena
+
+
+def numpy_unique(numpy, words):
+    """Sort a NumPy array and drop its duplicates (numpy.unique() hashes
+    them first, which is slower here)."""
+    words = numpy.sort(words)
+    keep = numpy.ones(len(words), bool)
+    keep[1:] = words[1:] != words[:-1]
+    return words[keep]
+
+
+def numpy_product(numpy, prefixes, suffixes, limits=None):
+    """Return the concatenations of every prefix with every suffix, as a
+    NumPy array of bytes, built by broadcasting the prefixes of each length
+    against the suffixes. With (wcfrom, wcto) limits, only the products
+    within them are built."""
+    if not prefixes or not suffixes:
+        return numpy.array([], dtype='S1')
+    suffixes = numpy.array([suffix.encode() for suffix in suffixes], dtype='S')
+    suffix_lengths = numpy.char.str_len(suffixes)
+    suffix_bytes = suffixes.view(numpy.uint8).reshape(len(suffixes), -1)
+    by_length = collections.defaultdict(list)
+    for prefix in prefixes:
+        by_length[len(prefix)].append(prefix.encode())
+
+    products = []
+    for length, group in sorted(by_length.items()):
+        tails = suffix_bytes
+        if limits is not None:
+            total = length + suffix_lengths
+            tails = suffix_bytes[(limits[0] < total) & (total < limits[1])]
+        group = numpy.array(group, dtype='S%i' % length).view(numpy.uint8)
+        group = group.reshape(-1, length)
+        rows = numpy.zeros((len(group), len(tails), length + tails.shape[1]), numpy.uint8)
+        rows[:, :, :length] = group[:, None, :]
+        rows[:, :, length:] = tails[None, :, :]
+        products.append(rows.view('S%i' % rows.shape[2]).reshape(-1))
+    return numpy.concatenate(products)
+
+
+# How a plan stage makes a word: its prefix and suffix tokens (suffix None
+# for single-pool stages), and whether the word is their leet version
+Match = collections.namedtuple('Match', 'stage prefix suffix leet')
+
+# Transforms that distribute over concatenation (reverse swapping the parts)
+SPLIT_TRANSFORMS = {'lower', 'upper', 'leet', 'reverse'}
+
+
+class PlanIndex:
+    """Membership index of the words a compiled plan makes from pools (and
+    of their leet versions with leetmode), for --query. Words are cut into
+    a prefix and a suffix form instead of making the products; stages with
+    a title transform are made and indexed whole."""
+
+    def __init__(self, plan, pools, leetmode=False):
+        self._accept = word_filter()
+        leet = leet_replacer()
+        self._stages = ([], [])
+        for stage in plan:
+            if stage.suffixes is not None and set(stage.transforms) <= SPLIT_TRANSFORMS:
+                swap = stage.transforms.count('reverse') % 2
+                tables = [self._table(zip(transform_words(stage, pools[pool]), pools[pool]))
+                          for pool in (stage.prefixes, stage.suffixes)]
+                if swap:
+                    tables.reverse()
+            else:
+                swap = None
+                if stage.suffixes is None:
+                    pairs = [(token, None) for token in pools[stage.prefixes]]
+                else:
+                    pairs = list(itertools.product(pools[stage.prefixes], pools[stage.suffixes]))
+                words = transform_words(stage, (p + (s or '') for p, s in pairs))
+                tables = [self._table(zip(words, pairs))]
+            self._stages[0].append((stage.name, swap, tables, self._cuts(tables)))
+            if leetmode:
+                tables = [self._table((leet(word), token) for word, token in table.items())
+                          for table in tables]
+                self._stages[1].append((stage.name, swap, tables, self._cuts(tables)))
+
+    @staticmethod
+    def _table(items):
+        """Dict of the (form, token) items, keeping the first token of each
+        form, as the plan makes it first."""
+        table = {}
+        for form, token in items:
+            table.setdefault(form, token)
+        return table
+
+    @staticmethod
+    def _cuts(tables):
+        """The lengths of the forms of the table with the fewest of them,
+        negated for the second table, where query() cuts words."""
+        if len(tables) == 1:
+            return None
+        heads, tails = ({len(word) for word in table} for table in tables)
+        return sorted(heads) if len(heads) <= len(tails) else sorted(-n for n in tails)
+
+    def query(self, word):
+        """Return the Match of the first stage making word, or else of the
+        first one making it as a leet version, or None. The word length
+        limits and the password policy are not checked (see
+        __contains__())."""
+        for leet, stages in enumerate(self._stages):
+            for name, swap, tables, cuts in stages:
+                if cuts is None:
+                    if word in tables[0]:
+                        return Match(name, *tables[0][word], bool(leet))
+                    continue
+                first, second = tables
+                for i in cuts:
+                    i = i if i >= 0 else len(word) + i
+                    if i < 0 or i > len(word):
+                        continue
+                    head, tail = word[:i], word[i:]
+                    if head in first and tail in second:
+                        prefix, suffix = first[head], second[tail]
+                        if swap:
+                            prefix, suffix = suffix, prefix
+                        return Match(name, prefix, suffix, bool(leet))
+        return None
+
+    def __contains__(self, word):
+        """Whether word is in the wordlist: made by some stage and within the
+        length limits, matching the password policy."""
+        return self._accept(word) and self.query(word) is not None
+
+
+def query_passwords(pools, leetmode, filename):
+    """Implementation of --query: tell for each password of filename (one
+    per line) whether the wordlist of the profile holds it, and which stage
+    makes it, from a PlanIndex. Return how many it holds."""
+    index = PlanIndex(CONFIG['plan'], pools, leetmode)
+    found = total = 0
+    with open(filename) as f:
+        for line in f:
+            password = line.rstrip('\r\n')
+            if not password:
+                continue
+            total += 1
+            match = index.query(password)
+            if match is None:
+                print("[-] %s: not generated" % password)
+                continue
+            how = match.prefix if match.suffix is None else \
+                '%s + %s' % (match.prefix, match.suffix)
+            how += ', leet' if match.leet else ''
+            if password not in index:
+                print("[-] %s: made by %s (%s), but left out by the length limits"
+                      " or the password policy" % (password, match.stage, how))
+                continue
+            found += 1
+            print("[+] %s: made by \033[1;31m%s\033[1;m (%s)" % (password, match.stage, how))
+    print("\n[+] The wordlist holds \033[1;31m%i\033[1;m of the %i passwords."
+          % (found, total))
+    return found
+
+
+def report_stats(output):
+    """Print the per-stage yield statistics of the current run and save them
+    as JSON next to the output file."""
+    import json
+    times = {}
+    for stage in PROFILE['stages']:
+        times[stage['stage']] = times.get(stage['stage'], 0) + stage['wall']
+
+    stats = PROFILE['yield']
+    for stage in stats:
+        stage['time'] = times.get(stage['stage'], 0.0)
+    print("\n[+] Stage yield (unique = not yielded by an earlier stage,"
+          " in length = unique and %i < length < %i):\n"
+          % (CONFIG['wcfrom'], CONFIG['wcto']))
+    print("    %-12s %10s %10s %8s %10s %9s" % ('stage', 'raw', 'unique',
+                                              'unique%', 'in length', 'time (s)'))
+    for stage in sorted(stats, key=lambda s: s['in_length'], reverse=True):
+        print("    %-12s %10i %10i %7.1f%% %10i %9.4f"
+              % (stage['stage'], stage['raw'], stage['unique'],
+                 100.0 * stage['unique'] / (stage['raw'] or 1),
+                 stage['in_length'], stage['time']))
+
+    with open(output + '.stats.json', 'w') as f:
+        json.dump({'output': output, 'wcfrom': CONFIG['wcfrom'],
+                   'wcto': CONFIG['wcto'], 'stages': stats}, f, indent=2)
+    print("\n[+] Stage yield saved to %s.stats.json" % output)
+
+
+def report_profile(output):
+    """Print the per-stage table of the current run and save it as JSON next
+    to the output file."""
+    import json
+    stages = PROFILE['stages']
+    print("\n[+] Profile (per stage):\n")
+    print("    %-12s %10s %10s %12s" % ('stage', 'wall (s)', 'cpu (s)', 'peak (KiB)'))
+    for stage in stages:
+        print("    %-12s %10.4f %10.4f %12.1f" % (stage['stage'], stage['wall'],
+                                                stage['cpu'], stage['peak'] / 1024))
+    print("    %-12s %10.4f %10.4f" % ('total', sum(s['wall'] for s in stages),
+                                       sum(s['cpu'] for s in stages)))
+
+    with open(output + '.profile.json', 'w') as f:
+        json.dump({'output': output, 'stages': stages}, f, indent=2)
+    print("\n[+] Profile saved to %s.profile.json" % output)
+
+
+def interactive(rules=False, incremental=False, exclude=(), jobs=1, backend='python',
+                cache=None, split=None, query=None):
+    """Implementation of the -i switch. Interactively question the user and
+    create a password dictionary file based on the answer, or act on it as
+    the other arguments (the -i options of get_parser()) ask."""
+    profile = ask_profile()
+    name = profile['name']
+    started = time.time()
 
+    if query:
+        query_passwords(profile_pools(profile), profile['leetmode'], query)
+        return None
 
-def interactive():
-    """Implementation of the -i switch. Interactively question the user and
-    create a password dictionary file based on the answer."""
+    print("\n[+] Now making a dictionary...")
+    pools = profile_pools(profile)
+
+    if rules:
+        base = itertools.chain.from_iterable(pools[stage.prefixes] for stage in CONFIG['plan']
+                                             if stage.suffixes is None)
+        dates = pools['bdss'] + pools['wbdss'] + pools['kbdss']
+        return export_rules(name, base, dates, profile['spechars'],
+                            profile['randnum'], profile['leetmode'])
+    if incremental:
+        return update_wordlist(name, profile, pools, exclude, jobs, backend)
+
+    if cache is not None:
+        key = cache.key('profile', profile, [file_digest(f) for f in exclude])
+        if cache.fetch(key, name + '.txt'):
+            return name + '.txt'
+
+    print_backend(backend)
+    candidates = profile_candidates(pools, profile['leetmode'], jobs, backend)
+    params = {'mode': 'profile', 'profile': profile, 'exclude': list(exclude)}
+    finish_wordlist(name + '.txt', candidates, profile['leetmode'], exclude,
+                    params=params, started=started, split=split, verbose=True)
+    if cache is not None:
+        cache.store(key, name + '.txt')
+    return name + '.txt'
+
+
+def print_backend(backend):
+    """Tell the -i user that the wordlist is being made, and with which
+    backend when NumPy was asked for but is not installed."""
+    import importlib.util
+    if backend == 'numpy' and importlib.util.find_spec('numpy') is None:
+        print("[-] NumPy is not installed, using the Python backend.")
+    print("[+] Sorting list and removing duplicates...")
+
+
+def ask_profile():
+    """Question the user about the victim and return the answers as a dict."""
     print()
     print("[+] Insert the information about the victim to make a dictionary")
     print("[+] If you don't know all the info, just hit enter when asked! ;)\n")
@@ -187,48 +1115,67 @@ def interactive():
         words2 = input(prompt).replace(' ', '')
     words = words2.split(',')
 
-    spechars = []
     prompt = "Do you want to add special characters at the end of words? Y/[N]: "
     spechars1 = input(prompt).lower()
-    if spechars1 == "y":
-        for spec1 in CONFIG['chars']:
-            spechars.append(spec1)
-            for spec2 in CONFIG['chars']:
-                spechars.append(spec1+spec2)
-                for spec3 in CONFIG['chars']:
-                    spechars.append(spec1+spec2+spec3)
 
     randnum = input("Do you want to add some random numbers at the end of words? Y/[N]: ").lower()
     leetmode = input("Leet mode? (i.e. leet = 1337) Y/[N]: ").lower().strip()
 
-
-    print("\n[+] Now making a dictionary...")
-
+    return dict(name=name, surname=surname, nick=nick, birthdate=birthdate,
+                wife=wife, wifen=wifen, wifeb=wifeb,
+                kid=kid, kidn=kidn, kidb=kidb,
+                pet=pet, company=company, words=words,
+                spechars=spechars1 == 'y', randnum=randnum == 'y',
+                leetmode=leetmode == 'y')
+
+
+def string_list(value, separator):
+    """Return the strings of value, a list of them or a string split at
+    separator (nothing for None). Raise ValueError for anything else."""
+    value = value or []
+    if isinstance(value, str):
+        return value.split(separator)
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError("Words must be a string or a list of strings")
+    return value
+
+
+def profile_from_answers(answers):
+    """Return a profile, as ask_profile() would, from a dict of answers
+    (e.g. a JSON job of --serve). Missing answers are blank, words may be a
+    list or a comma-separated string, and the switches are booleans. Raise
+    ValueError for answers ask_profile() would not accept."""
+    texts = ('name', 'surname', 'nick', 'birthdate', 'wife', 'wifen', 'wifeb',
+             'kid', 'kidn', 'kidb', 'pet', 'company')
+    unknown = set(answers) - set(texts) - {'words', 'spechars', 'randnum', 'leetmode'}
+    if unknown:
+        raise ValueError("Unknown answers: %s" % ', '.join(sorted(unknown)))
+    for key in texts:
+        if not isinstance(answers.get(key) or '', str):
+            raise ValueError("The %s answer must be a string" % key)
+    profile = {key: (answers.get(key) or '').strip().lower() for key in texts}
+    if not profile['name']:
+        raise ValueError("You must enter a name at least!")
+    for key in ('birthdate', 'wifeb', 'kidb'):
+        if len(profile[key]) not in (0, 8):
+            raise ValueError("You must enter 8 digits for %s!" % key)
+
+    words = string_list(answers.get('words'), ',')
+    profile['words'] = [word.replace(' ', '') for word in words] or ['']
+    for key in ('spechars', 'randnum', 'leetmode'):
+        profile[key] = bool(answers.get(key))
+    return profile
+
+
+def profile_pools(profile):
+    """Build the canonical token pools of a profile (see ask_profile()),
+    including the suffix tables it asked for. Disabled suffix tables are
+    empty pools, so the stages using them produce nothing."""
     # Now me must do some string modifications
-
-    # Birthdays first
-
-    birthdate_yy, birthdate_yyy = birthdate[-2:], birthdate[-3:]
-    birthdate_yyyy = birthdate[-4:]
-    birthdate_xd, birthdate_xm = birthdate[1:2], birthdate[3:4]
-    birthdate_dd, birthdate_mm = birthdate[:2], birthdate[2:4]
-
-    wifeb_yy = wifeb[-2:]
-    wifeb_yyy = wifeb[-3:]
-    wifeb_yyyy = wifeb[-4:]
-    wifeb_xd = wifeb[1:2]
-    wifeb_xm = wifeb[3:4]
-    wifeb_dd = wifeb[:2]
-    wifeb_mm = wifeb[2:4]
-
-    kidb_yy = kidb[-2:]
-    kidb_yyy = kidb[-3:]
-    kidb_yyyy = kidb[-4:]
-    kidb_xd = kidb[1:2]
-    kidb_xm = kidb[3:4]
-    kidb_dd = kidb[:2]
-    kidb_mm = kidb[2:4]
-
+    name, surname, nick = profile['name'], profile['surname'], profile['nick']
+    wife, wifen = profile['wife'], profile['wifen']
+    kid, kidn = profile['kid'], profile['kidn']
+    pet, company, words = profile['pet'], profile['company'], profile['words']
 
     # Convert first letters to uppercase...
     nameup = name.title()
@@ -241,7 +1188,6 @@ def interactive():
     petup = pet.title()
     companyup = company.title()
     wordsup = [words1.title() for words1 in words]
-    word = words+wordsup
 
     # reverse a name
 
@@ -254,174 +1200,913 @@ def interactive():
     rev_kid = kid[::-1]
     rev_kidup = kidup[::-1]
 
-    reverse = [rev_name, rev_nameup, rev_nick, rev_nickup, rev_wife,
-               rev_wifeup, rev_kid, rev_kidup]
-    rev_n = [rev_name, rev_nameup, rev_nick, rev_nickup]
-    rev_w = [rev_wife, rev_wifeup]
-    rev_k = [rev_kid, rev_kidup]
-    # Let's do some serious work! This will be a mess of code, but who cares? :)
-
-    # Birthdays combinations
-    bds = [birthdate_yy, birthdate_yyy, birthdate_yyyy, birthdate_xd,
-           birthdate_xm, birthdate_dd, birthdate_mm]
-    bdss = []
-
-    for bds1 in bds:
-        bdss.append(bds1)
-        for bds2 in bds:
-            if bds.index(bds1) != bds.index(bds2):
-                bdss.append(bds1 + bds2)
-                for bds3 in bds:
-                    condition = (bds.index(bds1) != bds.index(bds2) and
-                                 bds.index(bds2) != bds.index(bds3) and
-                                 bds.index(bds1) != bds.index(bds3))
-                    if condition:
-                        bdss.append(bds1+bds2+bds3)
-
-
-    # For a woman...
-    wbds = [wifeb_yy, wifeb_yyy, wifeb_yyyy, wifeb_xd, wifeb_xm, wifeb_dd, wifeb_mm]
-    wbdss = []
-
-    for wbds1 in wbds:
-        wbdss.append(wbds1)
-        for wbds2 in wbds:
-            if wbds.index(wbds1) != wbds.index(wbds2):
-                wbdss.append(wbds1+wbds2)
-                for wbds3 in wbds:
-                    condition = (wbds.index(wbds1) != wbds.index(wbds2) and
-                                 wbds.index(wbds2) != wbds.index(wbds3) and
-                                 wbds.index(wbds1) != wbds.index(wbds3))
-                    if condition:
-                        wbdss.append(wbds1+wbds2+wbds3)
-
-
-    # and a child...
-    kbds = [kidb_yy, kidb_yyy, kidb_yyyy, kidb_xd, kidb_xm, kidb_dd, kidb_mm]
-    kbdss = []
-
-    for kbds1 in kbds:
-        kbdss.append(kbds1)
-        for kbds2 in kbds:
-            if kbds.index(kbds1) != kbds.index(kbds2):
-                kbdss.append(kbds1+kbds2)
-                for kbds3 in kbds:
-                    condition = (kbds.index(kbds1) != kbds.index(kbds2) and
-                                 kbds.index(kbds2) != kbds.index(kbds3) and
-                                 kbds.index(kbds1) != kbds.index(kbds3))
-                    if condition:
-                        kbdss.append(kbds1+kbds2+kbds3)
-
-    # string combinations
-    kombinaac = [pet, petup, company, companyup]
-    kombina = [name, surname, nick, nameup, surnameup, nickup]
-    kombinaw = [wife, wifen, wifeup, wifenup, surname, surnameup]
-    kombinak = [kid, kidn, kidup, kidnup, surname, surnameup]
-
-    kombinaa = []
-    for kombina1 in kombina:
-        kombinaa.append(kombina1)
-        for kombina2 in kombina:
-            condition = (kombina.index(kombina1) != kombina.index(kombina2) and
-                         kombina.index(kombina1.title()) != kombina.index(kombina2.title()))
-            if condition:
-                kombinaa.append(kombina1+kombina2)
-
-    kombinaaw = []
-    for kombina1 in kombinaw:
-        kombinaaw.append(kombina1)
-        for kombina2 in kombinaw:
-            condition = (kombinaw.index(kombina1) != kombinaw.index(kombina2) and
-                         kombinaw.index(kombina1.title()) != kombinaw.index(kombina2.title()))
-            if condition:
-                kombinaaw.append(kombina1+kombina2)
-
-    kombinaak = []
-    for kombina1 in kombinak:
-        kombinaak.append(kombina1)
-        for kombina2 in kombinak:
-            condition = (kombinak.index(kombina1) != kombinak.index(kombina2) and
-                         kombinak.index(kombina1.title()) != kombinak.index(kombina2.title()))
-            if condition:
-                kombinaak.append(kombina1+kombina2)
-
-
-    komb1 = list(komb(kombinaa, bdss))
-    komb2 = list(komb(kombinaaw, wbdss))
-    komb3 = list(komb(kombinaak, kbdss))
-    komb4 = list(komb(kombinaa, CONFIG['years']))
-    komb5 = list(komb(kombinaac, CONFIG['years']))
-    komb6 = list(komb(kombinaaw, CONFIG['years']))
-    komb7 = list(komb(kombinaak, CONFIG['years']))
-    komb8 = list(komb(word, bdss))
-    komb9 = list(komb(word, wbdss))
-    komb10 = list(komb(word, kbdss))
-    komb11 = list(komb(word, CONFIG['years']))
-    komb12 = komb13 = komb14 = komb15 = komb16 = komb21 = []
-    if randnum == "y":
-        komb12 = list(concats(word, CONFIG['numfrom'], CONFIG['numto']))
-        komb13 = list(concats(kombinaa, CONFIG['numfrom'], CONFIG['numto']))
-        komb14 = list(concats(kombinaac, CONFIG['numfrom'], CONFIG['numto']))
-        komb15 = list(concats(kombinaaw, CONFIG['numfrom'], CONFIG['numto']))
-        komb16 = list(concats(kombinaak, CONFIG['numfrom'], CONFIG['numto']))
-        komb21 = list(concats(reverse, CONFIG['numfrom'], CONFIG['numto']))
-    komb17 = list(komb(reverse, CONFIG['years']))
-    komb18 = list(komb(rev_w, wbdss))
-    komb19 = list(komb(rev_k, kbdss))
-    komb20 = list(komb(rev_n, bdss))
-    komb001 = komb002 = komb003 = komb004 = komb005 = komb006 = []
-    if spechars1 == "y":
-        komb001 = list(komb(kombinaa, spechars))
-        komb002 = list(komb(kombinaac, spechars))
-        komb003 = list(komb(kombinaaw, spechars))
-        komb004 = list(komb(kombinaak, spechars))
-        komb005 = list(komb(word, spechars))
-        komb006 = list(komb(reverse, spechars))
-
-    print("[+] Sorting list and removing duplicates...")
-
-    sets = [set(komb1), set(komb2), set(komb3), set(komb4), set(komb5),
-            set(komb6), set(komb7), set(komb8), set(komb9), set(komb10),
-            set(komb11), set(komb12), set(komb13), set(komb14), set(komb15),
-            set(komb16), set(komb17), set(komb18), set(komb19), set(komb20),
-            set(komb21), set(kombinaa), set(kombinaac), set(kombinaaw),
-            set(kombinaak), set(word), set(komb001), set(komb002), set(komb003),
-            set(komb004), set(komb005), set(komb006)]
-
-    uniqset = set()
-    for s in sets:
-        uniqset.update(s)
-
-    uniqlist = bdss + wbdss + kbdss + reverse + list(uniqset)
-
-    unique_lista = sorted(set(uniqlist))
-    unique_leet = []
-    if leetmode == "y":
-        for x in unique_lista:
-            unique_leet.append(leet_replace(x))
-
-    unique_list = unique_lista + unique_leet
-
-    unique_list_finished = [x for x in unique_list if CONFIG['wcfrom'] < len(x) < CONFIG['wcto']]
-    unique_list_finished.sort()
-
-    with open(name + '.txt', 'w') as f:
-        f.write(os.linesep.join(unique_list_finished))
-    with open(name + '.txt') as f:
-        lines = len(list(f)) # shorter, but possibly more memory expensive
+    pools = {
+        'word': unique_tokens(words + wordsup),
+        'reverse': unique_tokens([rev_name, rev_nameup, rev_nick, rev_nickup,
+                                  rev_wife, rev_wifeup, rev_kid, rev_kidup]),
+        'rev_n': unique_tokens([rev_name, rev_nameup, rev_nick, rev_nickup]),
+        'rev_w': unique_tokens([rev_wife, rev_wifeup]),
+        'rev_k': unique_tokens([rev_kid, rev_kidup]),
+
+        # Birthdays combinations
+        'bdss': profiled('bdss', iter_date_tokens(profile['birthdate'])),
+        # For a woman...
+        'wbdss': profiled('wbdss', iter_date_tokens(profile['wifeb'])),
+        # and a child...
+        'kbdss': profiled('kbdss', iter_date_tokens(profile['kidb'])),
+
+        # string combinations
+        'kombinaac': unique_tokens([pet, petup, company, companyup]),
+        'kombinaa': profiled('kombinaa', pair_tokens(unique_tokens(
+            [name, surname, nick, nameup, surnameup, nickup]))),
+        'kombinaaw': profiled('kombinaaw', pair_tokens(unique_tokens(
+            [wife, wifen, wifeup, wifenup, surname, surnameup]))),
+        'kombinaak': profiled('kombinaak', pair_tokens(unique_tokens(
+            [kid, kidn, kidup, kidnup, surname, surnameup]))),
+
+        'years': list(CONFIG['years']),
+        'numbers': list(CONFIG['numbers']) if profile['randnum'] else [],
+        'spechars': list(CONFIG['spechars']) if profile['spechars'] else [],
+    }
+    # More case forms, if asked for in [cases]
+    pools['cases'] = profiled('cases', case_variants(profile, pools))
+    return pools
+
+
+def profile_candidates(pools, leetmode=False, jobs=1, backend='python'):
+    """Run the stages of the generation plan over the given pools and return
+    the set of all candidates. Without --stats, return instead the WordArena
+    of numpy_candidates() with the numpy backend, or that of
+    run_plan_parallel() with jobs other than 1."""
+    if backend == 'numpy' and not PROFILE['stats']:
+        arena = numpy_candidates(CONFIG['plan'], pools, leetmode)
+        if arena is not None:
+            return arena
+    if jobs != 1 and not PROFILE['stats']:
+        return run_plan_parallel(CONFIG['plan'], pools, leetmode, jobs or None)
 
-    message = ("[+] Saving dictionary to \033[1;31m%s.txt\033[1;m, counting"
+    # Let's do some serious work! This will be a mess of code, but who cares? :)
+    stages = run_plan(CONFIG['plan'], pools, leetmode)
+    return merge_stages(stages)
+
+
+def profile_delta(old, pools):
+    """Yield the candidates of the plan stages that involve at least one
+    token not in the old pools. The pools must include the old tokens."""
+    new = {}
+    for key, tokens in pools.items():
+        known = set(old.get(key, ()))
+        new[key] = [token for token in tokens if token not in known]
+
+    for stage in CONFIG['plan']:
+        if stage.suffixes is None:
+            words = new[stage.prefixes]
+        else:
+            words = itertools.chain(komb(new[stage.prefixes], pools[stage.suffixes]),
+                                    komb(old.get(stage.prefixes, ()), new[stage.suffixes]))
+        yield from transform_words(stage, words)
+
+
+def update_wordlist(prefix, profile, pools, exclude=(), jobs=1, backend='python'):
+    """Implementation of --incremental. The first run writes <prefix>.txt as
+    usual and saves the profile with its token pools to <prefix>.cupp.json
+    and the sorted words written so far to <prefix>.cupp.idx. A re-run only
+    computes the products involving new tokens and appends the words that
+    are not in the index yet to <prefix>.delta.txt."""
+    import json
+
+    state_file, index_file = prefix + '.cupp.json', prefix + '.cupp.idx'
+    leetmode = profile['leetmode']
+    if not os.path.isfile(state_file):
+        print_backend(backend)
+        params = {'mode': 'profile', 'profile': profile, 'exclude': list(exclude)}
+        finish_wordlist(prefix + '.txt', profile_candidates(pools, leetmode, jobs, backend),
+                        leetmode, exclude, index_file, params=params, verbose=True)
+        output = prefix + '.txt'
+    else:
+        with open(state_file) as f:
+            state = json.load(f)
+        old = state['pools']
+        pools = {key: unique_tokens(old.get(key, []) + tokens)
+                 for key, tokens in pools.items()}
+
+        delta = profiled('delta', profile_delta(old, pools))
+        if leetmode:
+            delta += profiled('leet', map(leet_replace, delta))
+            if not state['profile']['leetmode']:
+                with open(index_file) as f:
+                    delta += [leet_replace(line.rstrip('\n')) for line in f]
+        leetmode = leetmode or state['profile']['leetmode']
+        with profile_stage('filter'):
+            delta = sorted(set(filter(word_filter(), delta)))
+        if exclude:
+            delta = profiled('exclude', exclude_sorted(delta, exclude))
+
+        with profile_stage('write'):
+            output = prefix + '.delta.txt'
+            words = merge_index(index_file, delta, output)
+
+        message = ("[+] Appending \033[1;31m%i\033[1;m new words to"
+                   " \033[1;31m%s\033[1;m (%i already generated).")
+        print(message % (len(words), output, len(delta) - len(words)))
+
+    profile = dict(profile, leetmode=leetmode)
+    with open(state_file, 'w') as f:
+        json.dump({'profile': profile, 'pools': pools}, f)
+    return output
+
+
+def merge_index(index_file, words, delta=None):
+    """Merge sorted, unique words into a sorted index file (one word per
+    line) in a single streaming pass, and return the words that were not in
+    the index yet. These are appended to the delta file, if given, and
+    synced to disk before the new index replaces the old one, so that the
+    index never lists words that no output holds."""
+    new = []
+    try:
+        with open(index_file) as index, open(index_file + '.tmp', 'w') as out:
+            lines = (line.rstrip('\n') for line in index)
+            current = next(lines, None)
+            for word in words:
+                while current is not None and current < word:
+                    out.write(current + '\n')
+                    current = next(lines, None)
+                if current == word:
+                    continue
+                out.write(word + '\n')
+                new.append(word)
+            while current is not None:
+                out.write(current + '\n')
+                current = next(lines, None)
+        if delta is not None:
+            with open(delta, 'a') as f:
+                f.writelines(word + '\n' for word in new)
+                f.flush()
+                os.fsync(f.fileno())
+    except BaseException:
+        os.remove(index_file + '.tmp')
+        raise
+    os.replace(index_file + '.tmp', index_file)
+    return new
+
+
+def leet_task(words):
+    """Worker of leet_parallel(): return the leet versions of the words
+    within the length limits and matching the password policy, sorted and
+    without duplicates as newline-terminated UTF-8 bytes."""
+    words = set(filter(word_filter(), map(leet_replacer(), words)))
+    return b''.join(word + b'\n' for word in sorted(w.encode() for w in words))
+
+
+def leet_parallel(uniqset, jobs=None, size=100000):
+    """shape_words() in jobs worker processes (one per CPU by default): the
+    set is drained in chunks of size words, whose leet versions are made and
+    filtered by the workers while the parent keeps the originals. Each
+    worker returns a sorted run, so the leet versions are merged with the
+    sorted originals when the WordArena is iterated instead of being sorted
+    again as a whole. At most two chunks per worker are in flight."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    jobs = jobs or os.cpu_count() or 1
+    arena = WordArena()
+    accept = word_filter()
+    runs, pending = [], collections.deque()
+    with profile_stage('leet'), ProcessPoolExecutor(
+            jobs, initializer=_init_worker, initargs=(current_config(),)) as executor:
+        while uniqset:
+            chunk = [uniqset.pop() for _ in range(min(size, len(uniqset)))]
+            arena.extend(filter(accept, chunk))
+            pending.append(executor.submit(leet_task, chunk))
+            while len(pending) > 2 * jobs:
+                runs.append(pending.popleft().result())
+        runs.extend(future.result() for future in pending)
+    with profile_stage('sort'):
+        arena.sort(unique=True)
+    for run in runs:
+        arena.add_run(run)
+    return arena
+
+
+def shape_words(uniqset, leetmode, jobs=1):
+    """Return a sorted WordArena of the candidates, with their leet versions
+    if asked, within the word length limits, matching the password policy
+    and without duplicates. The set is emptied on the way; a WordArena of
+    sorted runs, as returned by run_plan_parallel() or numpy_candidates(),
+    is taken as is. With leet and jobs other than 1, see leet_parallel()."""
+    if isinstance(uniqset, WordArena):
+        return uniqset
+    if leetmode and jobs != 1:
+        return leet_parallel(uniqset, jobs)
+    arena = WordArena()
+    accept = word_filter()
+    leet = leet_replacer()
+    with profile_stage('filter'):
+        while uniqset:
+            word = uniqset.pop()
+            if accept(word):
+                arena.append(word)
+            if leetmode:
+                word = leet(word)
+                if accept(word):
+                    arena.append(word)
+    with profile_stage('sort'):
+        arena.sort(unique=True)
+    return arena
+
+
+def finish_wordlist(filename, uniqset, leetmode, exclude=(), index=None,
+                    jobs=1, params=None, started=None, split=None, verbose=False):
+    """Shape the candidates (see shape_words()), leave out the words of the
+    exclude wordlists and save them to filename (or its parts, with a
+    Split) and to the index file if given, with a manifest (see
+    save_manifest()). Return the number of saved words."""
+    started = time.time() if started is None else started
+    words = iter(shape_words(uniqset, leetmode, jobs))
+    if exclude:
+        words = exclude_sorted(words, exclude)
+
+    writing = time.time()
+    with profile_stage('write'), contextlib.ExitStack() as stack:
+        if split is None:
+            writer = WordlistWriter(filename, manifest=True)
+        else:
+            writer = SplitWriter(filename, *split)
+        stack.enter_context(writer)
+        if index is None:
+            writer.writelines(words)
+        else:
+            indexer = stack.enter_context(WordlistWriter(index))
+            for word in words:
+                writer.write(word)
+                indexer.write(word)
+
+    save_manifest(filename, writer.manifest(), params, started, writing)
+    if verbose:
+        shown = filename
+        if split is not None:
+            shown = '%i parts of %s' % (len(writer.parts), filename)
+        message = ("[+] Saving dictionary to \033[1;31m%s\033[1;m, counting"
+                   " \033[1;31m%i\033[1;m words.")
+        print(message % (shown, writer.count))
+        message = ("[+] Now load your pistolero with \033[1;31m%s\033[1;m and"
+                   " shoot! Good luck!")
+        print(message % shown)
+        print("[+] Manifest saved to %s" % manifest_name(filename))
+    return writer.count
+
+
+def manifest_name(filename):
+    return filename + '.manifest.json'
+
+
+def save_manifest(filename, manifest, params, started, writing):
+    """Save the manifest of the wordlist filename, as returned by
+    WordlistWriter.manifest(), to <filename>.manifest.json, along with the
+    generation params, the settings shaping the words (see
+    manifest_settings()), the cupp version and the time spent generating
+    (from started to writing) and writing the words. Copies of the wordlist
+    can be checked against it without counting or hashing the original
+    again."""
+    import json
+    finished = time.time()
+    manifest = dict(manifest, params=canonical(params or {}), version=__version__,
+                    config=manifest_settings(),
+                    timing={'started': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                                     time.gmtime(started)),
+                            'generate': writing - started,
+                            'write': finished - writing})
+    with open(manifest_name(filename), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+# Settings of the config that shape the words, recorded in the manifests
+MANIFEST_SETTINGS = ('years', 'numfrom', 'numto', 'numpadding', 'chars', 'chardepth',
+                     'wcfrom', 'wcto', 'leet', 'cases', 'policy')
+
+
+def manifest_settings():
+    """Return the MANIFEST_SETTINGS of the config in use and the stage names
+    of its plans as JSON data, with the digest of the whole config. The rest
+    of the config (e.g. the downloader credentials) stays out of it."""
+    config = current_config()
+    settings = {name: canonical(config[name]) for name in MANIFEST_SETTINGS}
+    settings['plan'] = [stage.name for stage in config['plan']]
+    settings['wordlist_plan'] = [stage.name for stage in config['wordlist_plan']]
+    settings['sha256'] = json_digest(config)
+    return settings
+
+
+class WordArena:
+    """Compact store for many candidates: their UTF-8 bytes are packed one
+    per line in a bytearray with an array of end offsets, about a third of
+    the memory of a list of str. Iterating yields the words as str, in
+    order once sorted."""
+
+    def __init__(self, words=()):
+        from array import array
+        self._data = bytearray()
+        self._offsets = array('Q', [0])
+        self._runs = None
+        self._unique = False
+        self.extend(words)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def append(self, word):
+        self._data += word.encode() + b'\n'
+        self._offsets.append(len(self._data))
+        self._runs = None
+
+    def extend(self, words):
+        for word in words:
+            self.append(word)
+
+    def add_run(self, run):
+        """Append a run of sorted, unique words given as newline-terminated
+        UTF-8 bytes. Iterating merges the runs and drops the duplicates
+        across them, without any sort(). Words appended since the last
+        sort() are sorted first, as runs of their own."""
+        if self._runs is None and len(self):
+            self.sort(unique=True)
+        start, end = len(self), len(self._data)
+        self._data += run
+        # The offsets come from the newlines, not from a list of the words
+        self._offsets.extend(end + match.end() for match in re.finditer(b'\n', run))
+        self._runs = (self._runs or []) + [(start, len(self))]
+        self._unique = True
+
+    def _words(self, start, stop):
+        """The words from index start to stop, as bytes."""
+        offsets = self._offsets
+        return bytes(self._data[offsets[start]:offsets[stop]]).split(b'\n')[:-1]
+
+    def sort(self, unique=False, run=65536):
+        """Sort the words bytewise, which is code point order, optionally
+        dropping duplicates. Runs of words are sorted and written back in
+        place, and merged when iterating, so only one run is unpacked at a
+        time; duplicates across runs are dropped by the merge."""
+        from array import array
+        data, offsets = self._data, self._offsets
+        size, length = len(offsets) - 1, 0
+        runs = []
+        for start in range(0, size, run):
+            words = self._words(start, min(start + run, size))
+            words.sort()
+            if unique:
+                words = list(dict.fromkeys(words))
+            blob = b'\n'.join(words) + b'\n'
+            data[offsets[length]:offsets[length] + len(blob)] = blob
+            ends = itertools.accumulate((len(word) + 1 for word in words),
+                                        initial=offsets[length])
+            next(ends)
+            offsets[length + 1:length + 1 + len(words)] = array('Q', ends)
+            runs.append((length, length + len(words)))
+            length += len(words)
+        del data[offsets[length]:]
+        del offsets[length + 1:]
+        self._runs = runs
+        self._unique = unique
+
+    def _iter_run(self, start, stop, block):
+        for i in range(start, stop, block):
+            yield from self._words(i, min(i + block, stop))
+
+    def __iter__(self):
+        import heapq
+        runs = self._runs or [(0, len(self))]
+        if len(runs) == 1:
+            words = self._iter_run(*runs[0], 65536)
+        else:
+            # Unpack fewer words at a time when merging many runs
+            block = max(64, 65536 // len(runs))
+            words = heapq.merge(*(self._iter_run(*run, block) for run in runs))
+            if self._unique:
+                words = (word for word, _ in itertools.groupby(words))
+        for word in words:
+            yield word.decode()
+
+
+class WordlistWriter:
+    """Context manager writing a wordlist in large buffered chunks, one word
+    per line, while counting the words. The words go to a temporary file in
+    the same directory, renamed to filename only when the block succeeds,
+    so a cracker never picks up a half-written list. With binary, words are
+    bytes. With manifest, the SHA-256 digest of the file and the histogram
+    of the word lengths are computed on the way too (see manifest())."""
+
+    def __init__(self, filename, binary=False, chunk=100000, manifest=False):
+        import hashlib
+        import locale
+        self.filename = filename
+        self.count = 0
+        self.size = 0
+        self.lengths = collections.Counter()
+        self._tmpname = '%s.%i.tmp' % (filename, os.getpid())
+        self._file = open(self._tmpname, 'wb')
+        self._encoding = None if binary else locale.getpreferredencoding(False)
+        self._linesep = os.linesep.encode() if binary else os.linesep
+        self._digest = hashlib.sha256() if manifest else None
+        self._chunk = chunk
+        self._buffer = []
+
+    def write(self, word):
+        """Add a word to the wordlist."""
+        self._buffer.append(word)
+        if len(self._buffer) >= self._chunk:
+            self.flush()
+
+    def writelines(self, words):
+        """Add all the given words to the wordlist."""
+        words = iter(words)
+        while True:
+            self._buffer.extend(itertools.islice(words, self._chunk - len(self._buffer)))
+            if len(self._buffer) < self._chunk:
+                break
+            self.flush()
+
+    def flush(self):
+        """Write the buffered words to the temporary file."""
+        if not self._buffer:
+            return
+        data = self._linesep.join(self._buffer)
+        if self.count:
+            data = self._linesep + data
+        if self._encoding is not None:
+            data = data.encode(self._encoding)
+        self._file.write(data)
+        self.size += len(data)
+        if self._digest is not None:
+            self._digest.update(data)
+            self.lengths.update(map(len, self._buffer))
+        self.count += len(self._buffer)
+        self._buffer = []
+
+    def manifest(self):
+        """Return the number of words written, the size and the SHA-256
+        digest of the file and the number of words of each length."""
+        return {'count': self.count, 'bytes': self.size,
+                'sha256': self._digest.hexdigest(),
+                'lengths': dict(sorted(self.lengths.items()))}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self._file.close()
+            if exc_type is None:
+                os.replace(self._tmpname, self.filename)
+            else:
+                os.remove(self._tmpname)
+
+
+# How finish_wordlist() splits a wordlist: at most lines words and size
+# bytes per part (None: no limit), written by up to workers threads
+Split = collections.namedtuple('Split', 'lines size workers')
+
+
+def part_name(filename, number):
+    """Name of the part number (from 1) of the wordlist filename."""
+    root, ext = os.path.splitext(filename)
+    return '%s.%04i%s' % (root, number, ext)
+
+
+class SplitWriter:
+    """WordlistWriter for wordlists split into numbered parts (see
+    part_name()) of at most lines words and size bytes each. Every part is
+    written by a thread of its own, up to workers at a time, with a
+    WordlistWriter and its manifest, so it is renamed into place as soon as
+    it is complete and can be shipped while the next ones are written. The
+    manifests of the parts are in parts, once the block is over."""
+
+    def __init__(self, filename, lines=None, size=None, workers=4, chunk=100000):
+        import locale
+        from concurrent.futures import ThreadPoolExecutor
+        self.filename = filename
+        self.count = 0
+        self.parts = []
+        self._lines, self._size = lines, size
+        self._encoding = locale.getpreferredencoding(False)
+        self._linesep = len(os.linesep)
+        self._executor = ThreadPoolExecutor(workers)
+        self._workers = max(workers, 1)
+        self._futures = []
+        self._queue = None
+        self._chunk = chunk
+        self._buffer = []
+        self._part_lines = self._part_size = 0
+
+    def write(self, word):
+        """Add a word to the wordlist."""
+        size = 0
+        if self._size:
+            size = len(word) if word.isascii() else len(word.encode(self._encoding))
+        if self._queue is None or (self._lines and self._part_lines >= self._lines) or (
+                self._size and self._part_lines
+                and self._part_size + self._linesep + size > self._size):
+            self._next_part()
+        if self._part_lines:
+            size += self._linesep
+        self._buffer.append(word)
+        self._part_lines += 1
+        self._part_size += size
+        if len(self._buffer) >= self._chunk:
+            self._put(self._buffer)
+            self._buffer = []
+
+    def writelines(self, words):
+        """Add all the given words to the wordlist. Without a size limit,
+        the words between part boundaries are taken in bulk."""
+        words = iter(words)
+        for word in words:
+            self.write(word)
+            if self._size:
+                continue
+            room = self._chunk - len(self._buffer)
+            if self._lines:
+                room = min(room, self._lines - self._part_lines)
+            more = list(itertools.islice(words, room))
+            self._buffer.extend(more)
+            self._part_lines += len(more)
+            if len(self._buffer) >= self._chunk:
+                self._put(self._buffer)
+                self._buffer = []
+
+    def _put(self, item):
+        import queue
+        while True:
+            try:
+                return self._queue.put(item, timeout=1)
+            except queue.Full:
+                # Do not wait forever on a writer that failed
+                if self._futures[-1].done():
+                    self._futures[-1].result()
+
+    def _next_part(self):
+        """Close the current part, if any, and start writing the next one
+        once fewer than workers parts are being written."""
+        import queue
+        self._close_part(None)
+        if len(self._futures) >= self._workers:
+            self._futures[-self._workers].result()
+        self._queue = queue.Queue(2)
+        filename = part_name(self.filename, len(self._futures) + 1)
+        self._futures.append(self._executor.submit(_write_part, filename, self._queue))
+        self._part_lines = self._part_size = 0
+
+    def _close_part(self, end):
+        if self._queue is not None:
+            if self._buffer:
+                self._put(self._buffer)
+                self._buffer = []
+            self._put(end)
+
+    def manifest(self):
+        """Return the number of words, the total size, the number of words
+        of each length and the manifests of the parts."""
+        lengths = collections.Counter()
+        for part in self.parts:
+            lengths.update(part['lengths'])
+        return {'count': self.count, 'bytes': sum(part['bytes'] for part in self.parts),
+                'lengths': dict(sorted(lengths.items())), 'parts': self.parts}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            self._close_part(None if exc_type is None else False)
+        finally:
+            self._executor.shutdown()
+        if exc_type is None:
+            self.parts = [future.result() for future in self._futures]
+            self.count = sum(part['count'] for part in self.parts)
+
+
+def _write_part(filename, chunks):
+    """Writer thread of SplitWriter: write the chunks of words taken from
+    the queue to filename until None, or give it up at False (the wordlist
+    failed). Return the manifest of the part."""
+    with WordlistWriter(filename, manifest=True) as writer:
+        for chunk in iter(chunks.get, None):
+            if chunk is False:
+                raise RuntimeError('%s was given up' % filename)
+            writer.writelines(chunk)
+    return dict(writer.manifest(), file=os.path.basename(filename))
+
+
+def file_digest(filename):
+    """Return the SHA-256 hex digest of the contents of a file."""
+    import hashlib
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(functools.partial(f.read, 1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def copy_file(source, destination):
+    """Copy a file through a temporary file renamed when complete, like
+    WordlistWriter."""
+    import shutil
+    tmpname = '%s.%i.tmp' % (destination, os.getpid())
+    try:
+        shutil.copyfile(source, tmpname)
+        os.replace(tmpname, destination)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+
+
+def json_digest(value):
+    """Return the SHA-256 hex digest of value as canonical() JSON."""
+    import hashlib
+    import json
+    data = json.dumps(canonical(value), sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def canonical(value):
+    """Return value (e.g. a Config) as plain JSON data, with mappings and
+    sets in a stable order, for hashing."""
+    if isinstance(value, collections.abc.Mapping):
+        return {str(key): canonical(item) for key, item in value.items()}
+    if hasattr(value, '_asdict'):
+        return canonical(value._asdict())
+    if isinstance(value, (set, frozenset)):
+        return sorted(canonical(item) for item in value)
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    return value
+
+
+class WordlistCache:
+    """Directory of finished wordlists (the --cache option), named after a
+    hash of everything that determines them: what they were made from, the
+    config in use, the options and the cupp version. The least recently
+    used wordlists are evicted to keep the directory under maxsize bytes."""
+
+    def __init__(self, directory, maxsize=1 << 30):
+        self.directory = directory
+        self.maxsize = maxsize
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, *parts):
+        """Return the cache key of a wordlist made from parts, which must be
+        JSON data, with the current config."""
+        return json_digest([__version__, current_config(), parts])
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.txt')
+
+    def fetch(self, key, filename):
+        """Copy the cached wordlist of key to filename and return True, or
+        return False if it is not cached."""
+        try:
+            copy_file(self.path(key), filename)
+        except FileNotFoundError:
+            return False
+        if os.path.isfile(manifest_name(self.path(key))):
+            copy_file(manifest_name(self.path(key)), manifest_name(filename))
+        os.utime(self.path(key))
+        print("[+] Cache hit, copied \033[1;31m%s\033[1;m to \033[1;31m%s\033[1;m."
+              % (self.path(key), filename))
+        return True
+
+    def store(self, key, filename):
+        """Add the wordlist filename, with its manifest if any, to the cache
+        under key, then evict the least recently used wordlists beyond
+        maxsize."""
+        if os.path.isfile(manifest_name(filename)):
+            copy_file(manifest_name(filename), manifest_name(self.path(key)))
+        copy_file(filename, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.txt') and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.maxsize:
+                break
+            os.remove(path)
+            if os.path.isfile(manifest_name(path)):
+                os.remove(manifest_name(path))
+            total -= size
+
+
+def exclude_sorted(words, filenames):
+    """Lazily yield the sorted words that are in none of the given sorted
+    wordlists. Plain files are memory-mapped and searched with a binary
+    search that resumes where the previous word was found; gzipped files are
+    streamed once alongside the words. Either way, only a few pages of each
+    wordlist are held in memory at a time."""
+    for filename in filenames:
+        if filename.endswith('.gz'):
+            words = _exclude_stream(words, filename)
+        else:
+            words = _exclude_mmap(words, filename)
+    return words
+
+
+def _exclude_mmap(words, filename):
+    """Helper for exclude_sorted(), for an uncompressed wordlist."""
+    import mmap
+
+    with open(filename, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            yield from words
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            lo = 0
+            for word in words:
+                found, lo = _mmap_search(mm, word.encode(), lo)
+                if not found:
+                    yield word
+
+
+def _mmap_search(mm, word, lo):
+    """Binary search a sorted, newline separated mmap for a line equal to
+    word, from the line starting at offset lo. Return (found, offset of the
+    line found or of the first line after word)."""
+    hi = len(mm)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = mm.rfind(b'\n', 0, mid) + 1
+        end = mm.find(b'\n', mid)
+        if end == -1:
+            end = len(mm)
+        line = mm[start:end].rstrip(b'\r')
+        if line == word:
+            return True, start
+        if line < word:
+            lo = end + 1
+        else:
+            hi = start
+    return False, lo
+
+
+def _exclude_stream(words, filename):
+    """Helper for exclude_sorted(), merging the words with a gzipped
+    wordlist in a single pass."""
+    import gzip
+
+    with gzip.open(filename, 'rb') as f:
+        lines = (line.rstrip(b'\r\n') for line in f)
+        current = next(lines, None)
+        for word in words:
+            key = word.encode()
+            while current is not None and current < key:
+                current = next(lines, None)
+            if current != key:
+                yield word
+
+
+def read_wordlist(filename):
+    """Yield the words of a wordlist as bytes, one per line, skipping blank
+    lines. Gzipped files are read transparently."""
+    import gzip
+
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rb') as f:
+        for line in f:
+            word = line.rstrip(b'\r\n')
+            if word:
+                yield word
+
+
+def sorted_wordlist(filename, chunk=1000000):
+    """Return an iterator over the words of a wordlist in bytewise order.
+    Sorted files are streamed as they are; others are sorted externally, in
+    runs of at most chunk words spilled to temporary files."""
+    previous = b''
+    for word in read_wordlist(filename):
+        if word < previous:
+            return _external_sort(read_wordlist(filename), chunk)
+        previous = word
+    return read_wordlist(filename)
+
+
+def _external_sort(words, chunk):
+    """Helper for sorted_wordlist(): sort runs of words into temporary files
+    and merge them."""
+    import heapq
+    import tempfile
+
+    runs = []
+    try:
+        while True:
+            run = sorted(itertools.islice(words, chunk))
+            if not run:
+                break
+            f = tempfile.TemporaryFile()
+            f.writelines(word + b'\n' for word in run)
+            f.seek(0)
+            runs.append(f)
+        yield from heapq.merge(*((line.rstrip(b'\n') for line in f) for f in runs))
+    finally:
+        for f in runs:
+            f.close()
+
+
+def wordlist_algebra(operation, filenames):
+    """Lazily yield, in bytewise order and without duplicates, the union,
+    intersection or difference (the first wordlist minus all the others) of
+    the given wordlists, with a single k-way merge over them."""
+    import heapq
+
+    streams = [zip(sorted_wordlist(filename), itertools.repeat(i))
+               for i, filename in enumerate(filenames)]
+    merged = heapq.merge(*streams)
+    for word, group in itertools.groupby(merged, key=lambda item: item[0]):
+        sources = set(i for _, i in group)
+        if (operation == 'union' or
+                operation == 'intersect' and len(sources) == len(filenames) or
+                operation == 'diff' and sources == {0}):
+            yield word
+
+
+def combine_wordlists(operation, filenames, output):
+    """Implementation of --union, --intersect and --diff. Save the result
+    of the operation over the given wordlists to output."""
+    print("[+] Computing the %s of %i wordlists..." % (operation, len(filenames)))
+    with profile_stage(operation), WordlistWriter(output, binary=True) as writer:
+        writer.writelines(wordlist_algebra(operation, filenames))
+
+    message = ("[+] Saving dictionary to \033[1;31m%s\033[1;m, counting"
                " \033[1;31m%i\033[1;m words.")
-    print(message % (name, lines))
-    message = ("[+] Now load your pistolero with \033[1;31m%s.txt\033[1;m and"
-               " shoot! Good luck!")
-    print(message % name)
-    sys.exit()
+    print(message % (output, writer.count))
+    return output
+
+
+def rule_append(suffix):
+    """Return the hashcat/John rule appending the given suffix (: for none)."""
+    return ''.join('$' + c for c in suffix) or ':'
+
+
+def mask_escape(s):
+    """Escape a literal string or charset for a hashcat .hcmask line."""
+    return s.replace('?', '??').replace(',', '\\,')
+
+
+def export_rules(prefix, base, suffixes, spechars, numbers, leet):
+    """Implementation of --rules. Instead of expanding every base word here,
+    write the base words to <prefix>.base.txt, plus <prefix>.rule appending
+    the given suffixes, the years and (optionally) the special chars and
+    numbers, with a leet variant of every rule, and <prefix>.hcmask holding
+    the same years, numbers and special chars as masks for hybrid (-a 6)
+    attacks.
+
+    Rules apply to every base word, so the candidates are a superset of the
+    normal output. Length shaping (wcfrom/wcto) is left to the cracker."""
+    suffixes = list(suffixes) + list(CONFIG['years'])
+    if numbers:
+        suffixes += CONFIG['numbers']
+    if spechars:
+        suffixes += CONFIG['spechars']
+    rules = [rule_append(s) for s in dict.fromkeys([''] + suffixes)]
+    if leet:
+        leet_rule = ' '.join('s%s%s' % (c, n) for c, n in LEET_CONFIG.items()
+                             if len(c) == len(n) == 1)
+        rules += [rule + ' ' + leet_rule for rule in rules]
+
+    masks = [mask_escape(year) for year in CONFIG['years']]
+    if numbers:
+        masks += ['?d' * n for n in sorted({len(num) for num in CONFIG['numbers']})]
+    if spechars:
+        charset = mask_escape(''.join(dict.fromkeys(''.join(CONFIG['chars']))))
+        masks += ['%s,%s' % (charset, '?1' * n)
+                  for n in range(1, CONFIG['chardepth'] + 1)]
+
+    base = sorted(set(word for word in base if word))
+    with WordlistWriter(prefix + '.base.txt') as writer:
+        writer.writelines(base)
+    with open(prefix + '.rule', 'w') as f:
+        f.write('# cupp.py rules, keep words of length %i to %i\n'
+                % (CONFIG['wcfrom'] + 1, CONFIG['wcto'] - 1))
+        f.write('\n'.join(rules) + '\n')
+    with open(prefix + '.hcmask', 'w') as f:
+        f.write('\n'.join(masks) + '\n')
+
+    print("[+] Saving %i base words to \033[1;31m%s.base.txt\033[1;m" % (len(base), prefix))
+    print("[+] Saving %i rules to \033[1;31m%s.rule\033[1;m and %i masks to"
+          " \033[1;31m%s.hcmask\033[1;m" % (len(rules), prefix, len(masks), prefix))
+    print("[+] e.g. hashcat -r %s.rule HASHES %s.base.txt" % (prefix, prefix))
+    return prefix + '.base.txt'
 
 
 def download_ftp_files(ftp_dir, *filenames):
     """Helper function for download_wordlist(). Download the given files from
     the ftp directory."""
+    import ftplib
 
     print("\n[+] connecting...\n")
     ftp = ftplib.FTP(FTP_CONFIG['url'], FTP_CONFIG['user'], FTP_CONFIG['password'])
@@ -562,6 +2247,10 @@ def download_wordlist():
 def alectodb_download():
     """Download csv from alectodb and save into local file as a list of
     usernames and passwords"""
+    import csv
+    import gzip
+    from urllib.request import urlopen
+
     url = CONFIG['alectourl']
     local_file_name = url.split('/')[-1]
 
@@ -588,27 +2277,98 @@ def alectodb_download():
     f.close()
 
     print("\n[+] Exporting to alectodb-usernames.txt and alectodb-passwords.txt")
-    with open('alectodb-usernames.txt', 'w') as usernames_file:
-        usernames_file.write(os.linesep.join(gus))
+    with WordlistWriter('alectodb-usernames.txt') as writer:
+        writer.writelines(gus)
 
-    with open('alectodb-passwords.txt', 'w') as passwords_file:
-        passwords_file.write(os.linesep.join(gpa))
+    with WordlistWriter('alectodb-passwords.txt') as writer:
+        writer.writelines(gpa)
     print("[+] Done.")
 
 
-def concats(seq, start, stop):
-    "Helper function for concatenations."
-    for s in seq:
-        for num in range(start, stop):
-            yield s + str(num)
-
-
 def komb(seq, start):
     "Helper function for sorting and making combinations."
     for mystr in seq:
         for mystr1 in start:
             yield mystr + mystr1
 
+# Slices of a DDMMYYYY date, in the order the birthdate tokens are combined.
+# D and M are the second digit of the day and of the month.
+DATE_FIELDS = (('YY', slice(-2, None)), ('YYY', slice(-3, None)),
+               ('YYYY', slice(-4, None)), ('D', slice(1, 2)), ('M', slice(3, 4)),
+               ('DD', slice(0, 2)), ('MM', slice(2, 4)))
+DATE_FORMAT_RE = re.compile('YYYY|YYY|YY|DD|MM|D|M')
+
+
+def format_date(date, fmt):
+    """Render a DDMMYYYY date with a format such as MMDD or YYYY-MM-DD."""
+    fields = dict(DATE_FIELDS)
+    return DATE_FORMAT_RE.sub(lambda m: date[fields[m.group()]], fmt)
+
+
+@functools.lru_cache(maxsize=None)
+def date_combinations(date, formats=(), depth=3):
+    """Return the birthdate tokens of a DDMMYYYY date: every permutation of up
+    to `depth` of its slices, followed by the extra formats. Permutations are
+    taken by slice position, so equal slices (day == month) are still
+    combined. Cached by date string."""
+    slices = [date[s] for _, s in DATE_FIELDS]
+    tokens = [''.join(perm) for r in range(1, depth + 1)
+              for perm in itertools.permutations(slices, r)]
+    tokens.extend(format_date(date, fmt) for fmt in formats)
+    return tuple(dict.fromkeys(tokens))
+
+
+def iter_date_tokens(*dates):
+    """Lazily yield the birthdate tokens of any number of dates. Blank dates
+    are skipped."""
+    formats = CONFIG.get('dateformats', ())
+    for date in dates:
+        if date:
+            yield from date_combinations(date, formats)
+
+
+def unique_tokens(tokens):
+    """Canonicalize a token pool: drop empty tokens and repeated ones (e.g. the
+    title form of a token that has no letters), keeping the order."""
+    return [token for token in dict.fromkeys(tokens) if token]
+
+
+def case_variants(profile, pools=None):
+    """Yield the case variants (see CASE_VARIANTS) of the profile fields
+    chosen in [cases], lazily and at most budget per token. Forms already
+    produced, the lower and title forms of the tokens, the tokens of the
+    given pools (e.g. johnSmith in kombinaa) and forms too long for any word
+    are skipped, so the variants cost at most budget words per token in each
+    stage using them."""
+    cases = CONFIG['cases']
+    tokens = unique_tokens(itertools.chain.from_iterable(
+        profile[field] if field == 'words' else [profile[field]]
+        for field in cases['fields']))
+    seen = set(tokens)
+    seen.update(itertools.chain.from_iterable((pools or {}).values()))
+    seen.update(token.lower() for token in tokens)
+    seen.update(token.title() for token in tokens)
+    for token in tokens:
+        others = [other for other in tokens if other != token]
+        forms = itertools.chain.from_iterable(CASE_VARIANTS[name](token, others)
+                                              for name in cases['variants'])
+        forms = (form for form in forms
+                 if form not in seen and len(form) < CONFIG['wcto'])
+        for form in itertools.islice(forms, cases['budget']):
+            seen.add(form)
+            yield form
+
+
+def pair_tokens(pool):
+    """Yield each token of a canonical pool, followed by its concatenations
+    with the other tokens, except for its own lower/title forms."""
+    for token1 in pool:
+        yield token1
+        for token2 in pool:
+            if token1.title() != token2.title():
+                yield token1 + token2
+
+
 def leet_replace(s):
     """Replace all instances of a character in a string with their 1337
     counterpart as defined in LEET_CONFIG"""
@@ -617,16 +2377,31 @@ def leet_replace(s):
     return s
 
 
-def improve_dictionary(filename):
+def leet_replacer():
+    """Return a function doing leet_replace() with LEET_CONFIG read once,
+    for many words: a translation table, unless some replacement holds a
+    character replaced after it, which must then be replaced again."""
+    items = list(LEET_CONFIG.items())
+    if not any(c in n for i, (_, n) in enumerate(items) for c, _ in items[i + 1:]):
+        table = str.maketrans(dict(items))
+        return lambda s: s.translate(table)
+
+    def replace(s):
+        for c, n in items:
+            s = s.replace(c, n)
+        return s
+    return replace
+
+
+def improve_dictionary(filename, rules=False, exclude=(), cache=None, jobs=1,
+                       split=None):
     """Implementation of the -w option. Improve a dictionary by
-    interactively questioning the user."""
+    interactively questioning the user, with options as for interactive()."""
     with open(filename) as fajl:
         listic = fajl.readlines()
     linije = len(listic)
 
-    listica = []
-    for x in listic:
-        listica.extend(x.split())
+    listica = unique_tokens(word for x in listic for word in x.split())
 
     print()
     print("      *************************************************")
@@ -644,80 +2419,242 @@ def improve_dictionary(filename):
         conts = input(prompt).lower().strip()
     cont = []
     if conts == 'y':
-        for cont1 in listica:
-            for cont2 in listica:
-                if listica.index(cont1) != listica.index(cont2):
-                    cont.append(cont1+cont2)
+        cont = [cont1 + cont2 for cont1, cont2 in itertools.permutations(listica, 2)]
 
-    spechars = []
     prompt = "Do you want to add special chars at the end of words? Y/[N]: "
     spechars1 = input(prompt).lower()
-    if spechars1 == "y":
-        for spec1 in CONFIG['chars']:
-            spechars.append(spec1)
-            for spec2 in CONFIG['chars']:
-                spechars.append(spec1+spec2)
-                for spec3 in CONFIG['chars']:
-                    spechars.append(spec1+spec2+spec3)
 
     prompt = "Do you want to add some random numbers at the end of words? Y/[N]: "
     randnum = input(prompt).lower().strip()
     leetmode = input("Leet mode? (i.e. leet = 1337) Y/[N]: ").lower().strip()
+    started = time.time()
 
+    if rules:
+        return export_rules(filename + '.cupp', listica + cont, [],
+                            spechars1 == 'y', randnum == 'y', leetmode == 'y')
 
-    kombinacija1 = list(komb(listica, CONFIG['years']))
-    kombinacija2 = []
-    if conts == "y":
-        kombinacija2 = list(komb(cont, CONFIG['years']))
-    kombinacija3 = []
-    kombinacija4 = []
-    if spechars1 == "y":
-        kombinacija3 = list(komb(listica, spechars))
-        if conts == "y":
-            kombinacija4 = list(komb(cont, spechars))
-    kombinacija5 = []
-    kombinacija6 = []
-    if randnum == "y":
-        kombinacija5 = list(concats(listica, CONFIG['numfrom'], CONFIG['numto']))
-        if conts == "y":
-            kombinacija6 = list(concats(cont, CONFIG['numfrom'], CONFIG['numto']))
+    output = filename + '.cupp.txt'
+    if cache is not None:
+        key = cache.key('wordlist', file_digest(filename), bool(cont),
+                        spechars1 == 'y', randnum == 'y', leetmode == 'y',
+                        [file_digest(f) for f in exclude])
+        if cache.fetch(key, output):
+            return output
+
+    pools = wordlist_pools(listica, cont, spechars1 == 'y', randnum == 'y')
+    stages = run_plan(CONFIG['wordlist_plan'], pools, leetmode == 'y')
 
     print("\n[+] Now making a dictionary...")
 
     print("[+] Sorting list and removing duplicates...")
 
-    sets = [set(kombinacija1), set(kombinacija2), set(kombinacija3),
-            set(kombinacija4), set(kombinacija5), set(kombinacija6),
-            set(listica), set(cont)]
-
-    uniqset = set()
-    for s in sets:
-        uniqset.update(s)
+    uniqset = merge_stages(stages)
 
-    unique_lista = sorted(uniqset)
-    unique_leet = []
-    if leetmode == "y":
-        for x in unique_lista:
-            unique_leet.append(leet_replace(x))
+    params = {'mode': 'wordlist', 'wordlist': filename, 'concat': bool(cont),
+              'spechars': spechars1 == 'y', 'randnum': randnum == 'y',
+              'leetmode': leetmode == 'y', 'exclude': list(exclude)}
+    finish_wordlist(output, uniqset, leetmode == 'y', exclude, jobs=jobs,
+                    params=params, started=started, split=split, verbose=True)
+    if cache is not None:
+        cache.store(key, output)
+    return output
 
-    unique_list = unique_lista + unique_leet
 
-    unique_list_finished = [x for x in unique_list if CONFIG['wcfrom'] < len(x) < CONFIG['wcto']]
-    unique_list_finished.sort()
 
-    with open(filename+'.cupp.txt', 'w') as f:
-        f.write(os.linesep.join(unique_list_finished))
-
-    with open(filename+'.cupp.txt') as f:
-        lines = len(list(f))
+def wordlist_pools(listica, cont, spechars=False, randnum=False):
+    """Build the token pools of -w from the words of a wordlist and their
+    concatenations, with the suffix tables asked for."""
+    return {
+        'listica': listica,
+        'cont': cont,
+        'years': list(CONFIG['years']),
+        'numbers': list(CONFIG['numbers']) if randnum else [],
+        'spechars': list(CONFIG['spechars']) if spechars else [],
+    }
 
-    message = ("[+] Saving dictionary to \033[1;31m%s.cupp.txt\033[1;m, counting"
-               " \033[1;31m%i words.\033[1;m")
-    print(message % (filename, lines))
-    message = ("[+] Now load your pistolero with \033[1;31m%s.cupp.txt\033[1;m"
-               " and shoot! Good luck!")
-    print(message % filename)
 
+class Generator:
+    """Base of Profiler and Improver: run functions of this module with the
+    generator's own config, in a copy of the caller's context, so that
+    generators with different configs can run at the same time in threads
+    or asyncio tasks of one process."""
+
+    def __init__(self, config=None):
+        self.config = config if config is not None else load_config()
+
+    def run(self, function, *args, **kwargs):
+        """Call function(*args, **kwargs) with the config of the generator."""
+        return contextvars.copy_context().run(self._call, function, args, kwargs)
+
+    def _call(self, function, args, kwargs):
+        use_config(self.config)
+        return function(*args, **kwargs)
+
+
+class Profiler(Generator):
+    """Generator of the wordlists of profiles (see ask_profile()), i.e. of
+    the -i switch without the questions."""
+
+    def words(self, profile, jobs=1, backend='python'):
+        """Return the sorted words of a profile, as a WordArena."""
+        return self.run(self._words, profile, jobs, backend)
+
+    def _words(self, profile, jobs, backend):
+        pools = profile_pools(profile)
+        return shape_words(profile_candidates(pools, profile['leetmode'], jobs, backend),
+                           profile['leetmode'])
+
+    def generate(self, profile, filename, exclude=(), jobs=1, backend='python'):
+        """Save the words of a profile to filename, leaving out the words of
+        the exclude wordlists, and return their number."""
+        started = time.time()
+        words = self.words(profile, jobs, backend)
+        params = {'mode': 'profile', 'profile': profile, 'exclude': list(exclude)}
+        return self.run(finish_wordlist, filename, words, profile['leetmode'], exclude,
+                        params=params, started=started)
+
+
+class Improver(Generator):
+    """Generator improving wordlists, i.e. the -w option without the
+    questions."""
+
+    def words(self, words, concat=False, spechars=False, randnum=False,
+              leetmode=False):
+        """Return the sorted words generated from the given words (e.g. the
+        lines of a wordlist), as a WordArena. With concat, their
+        concatenations are combined too, up to the threshold number of
+        words."""
+        return self.run(self._words, words, concat, spechars, randnum, leetmode)
+
+    def _words(self, words, concat, spechars, randnum, leetmode):
+        listica = unique_tokens(word for line in words for word in line.split())
+        if concat and len(listica) > CONFIG['threshold']:
+            raise ValueError("Maximum number of words for concatenation is %i"
+                             % CONFIG['threshold'])
+        cont = [cont1 + cont2 for cont1, cont2 in itertools.permutations(listica, 2)] \
+            if concat else []
+        pools = wordlist_pools(listica, cont, spechars, randnum)
+        stages = run_plan(CONFIG['wordlist_plan'], pools, leetmode)
+        return shape_words(merge_stages(stages), leetmode)
+
+    def generate(self, words, filename, concat=False, spechars=False,
+                 randnum=False, leetmode=False, exclude=()):
+        """Save the words generated from the given words to filename, leaving
+        out the words of the exclude wordlists, and return their number."""
+        started = time.time()
+        words = self.words(words, concat, spechars, randnum, leetmode)
+        params = {'mode': 'wordlist', 'concat': concat, 'spechars': spechars,
+                  'randnum': randnum, 'leetmode': leetmode, 'exclude': list(exclude)}
+        return self.run(finish_wordlist, filename, words, leetmode, exclude,
+                        params=params, started=started)
+
+
+def iter_chunks(words, size=65536):
+    """Yield the given words as UTF-8 lines, gathered in chunks of about
+    size bytes."""
+    chunk, length = [], 0
+    for word in words:
+        line = word.encode() + b'\n'
+        chunk.append(line)
+        length += len(line)
+        if length >= size:
+            yield b''.join(chunk)
+            chunk, length = [], 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+def parse_address(address):
+    """Return the (host, port) of a port or a 'host:port' string, with host
+    '' if not given. Raise ValueError for a bad port."""
+    host, _, port = address.rpartition(':')
+    if not port.isdigit() or int(port) > 65535:
+        raise ValueError("bad port %r, expected [HOST:]PORT" % port)
+    return host, int(port)
+
+
+def make_server(address, workers=4):
+    """Return an HTTP server (see serve()) bound to address, a port or a
+    'host:port' string, running at most workers jobs at a time."""
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    host, port = parse_address(address)
+    profiler, improver = Profiler(current_config()), Improver(current_config())
+    slots = threading.BoundedSemaphore(workers)
+
+    def profile_job(job):
+        return profiler.words(profile_from_answers(job))
+
+    def wordlist_job(job):
+        words = string_list(job.get('words'), '\n')
+        return improver.words(words, bool(job.get('concat')), bool(job.get('spechars')),
+                              bool(job.get('randnum')), bool(job.get('leetmode')))
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        jobs = {'/profile': profile_job, '/wordlist': wordlist_job}
+
+        def do_POST(self):
+            job = self.jobs.get(self.path)
+            if job is None:
+                return self.send_error(404, "Post jobs to /profile or /wordlist")
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                answers = json.loads(self.rfile.read(length) or b'{}')
+                if not isinstance(answers, dict):
+                    raise ValueError("The job must be a JSON object")
+            except ValueError as err:
+                return self.send_error(400, str(err))
+            # A job holds its slot until the last word is sent, so at most
+            # workers word lists are in memory; a slow client only blocks
+            # its own thread, on the socket
+            if not slots.acquire(timeout=1):
+                self.send_response(503)
+                self.send_header('Retry-After', '1')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            try:
+                try:
+                    words = job(answers)
+                except ValueError as err:
+                    return self.send_error(400, str(err))
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for chunk in iter_chunks(words):
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                self.wfile.write(b'0\r\n\r\n')
+            except ConnectionError:
+                # The client went away, stop generating for it
+                self.close_connection = True
+            finally:
+                slots.release()
+
+    server = ThreadingHTTPServer((host or 'localhost', port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve(address, workers=4):
+    """Implementation of --serve. Generate wordlists for JSON jobs posted
+    over HTTP, with the config read once: answers of -i (see
+    profile_from_answers()) posted to /profile, or {"words": [...],
+    "concat", "spechars", "randnum", "leetmode"} for -w posted to
+    /wordlist. The sorted words are streamed back, one per line, with
+    chunked transfer encoding."""
+    server = make_server(address, workers)
+    host, port = server.server_address[:2]
+    print("[+] Serving on http://%s:%i/profile and /wordlist" % (host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[-] Leaving.", file=sys.stderr)
+    finally:
+        server.server_close()
 
 if __name__ == '__main__':
     main()
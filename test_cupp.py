@@ -1,8 +1,34 @@
 #!/usr/bin/env python3
 
+import collections
+import contextlib
+import gzip
+import io
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import tracemalloc
 import unittest
 from cupp3 import *
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def make_profile(**answers):
+    """Return profile answers as ask_profile() would, for the given fields."""
+    profile = dict(name='john', surname='', nick='', birthdate='', wife='',
+                   wifen='', wifeb='', kid='', kidn='', kidb='', pet='',
+                   company='', words=[''], spechars=False, randnum=False,
+                   leetmode=False)
+    profile.update(answers)
+    return profile
+
+
 class TestCupp3(unittest.TestCase):
     def setUp(self):
         read_config()
@@ -13,5 +39,510 @@ class TestCupp3(unittest.TestCase):
     def test_parser(self):
         pass
 
+    def test_profile_stage(self):
+        start_profiling()
+        try:
+            self.assertEqual(profiled('komb', komb(['a', 'b'], ['1'])), ['a1', 'b1'])
+            stage, = PROFILE['stages']
+            self.assertEqual(stage['stage'], 'komb')
+            self.assertGreaterEqual(stage['wall'], 0)
+            self.assertGreaterEqual(stage['peak'], 0)
+        finally:
+            PROFILE['enabled'] = False
+            tracemalloc.stop()
+
+    def test_date_combinations(self):
+        tokens = date_combinations('01011990')
+        # day == month must still be combined
+        self.assertIn('0101', tokens)
+        self.assertIn('01011990', tokens)
+        self.assertEqual(len(tokens), len(set(tokens)))
+        self.assertEqual(date_combinations('25121990', ('MM.DD',))[-1], '12.25')
+        self.assertEqual(format_date('25121990', 'YYYYMMDD'), '19901225')
+
+    def test_iter_date_tokens(self):
+        tokens = list(iter_date_tokens('01021990', '03041992'))
+        self.assertIn('0102', tokens)
+        self.assertIn('0304', tokens)
+
+    def test_suffix_tables(self):
+        self.assertIsInstance(CONFIG['years'], tuple)
+        self.assertEqual(CONFIG['numbers'][:3], ('0', '1', '2'))
+        self.assertEqual(len(CONFIG['spechars']), 7 + 7**2 + 7**3)
+        self.assertEqual(number_table(5, 12, padding=3),
+                         ('5', '6', '7', '8', '9', '10', '11',
+                          '05', '06', '07', '08', '09',
+                          '005', '006', '007', '008', '009', '010', '011'))
+        self.assertEqual(spechar_table('!@', depth=2),
+                         ('!', '@', '!!', '!@', '@!', '@@'))
+
+    def test_lazy_imports(self):
+        code = ("import sys, cupp3; print(' '.join(m for m in"
+                " ('ftplib', 'urllib.request', 'csv', 'gzip', 'configparser')"
+                " if m in sys.modules))")
+        out = subprocess.check_output([sys.executable, '-c', code],
+                                      cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(out.strip(), b'')
+
+    def test_export_rules(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            prefix = os.path.join(tmp, 'john')
+            output = export_rules(prefix, ['john', 'John', ''], ['0102'],
+                                  spechars=True, numbers=True, leet=True)
+            self.assertEqual(output, prefix + '.base.txt')
+            with open(output) as f:
+                self.assertEqual(f.read().split(), ['John', 'john'])
+            with open(prefix + '.rule') as f:
+                rules = f.read().splitlines()
+            self.assertIn(':', rules)
+            self.assertIn('$0$1$0$2', rules)
+            self.assertIn('$2$0$1$0', rules)
+            self.assertIn('$9$9 sa4 se3 sg9 si1 so0 ss5 st7 sz2', rules)
+            with open(prefix + '.hcmask') as f:
+                masks = f.read().splitlines()
+            self.assertIn('?d?d', masks)
+            self.assertTrue(masks[-1].endswith(',?1?1?1'))
+
+    def test_rule_append(self):
+        self.assertEqual(rule_append(''), ':')
+        self.assertEqual(rule_append('!1'), '$!$1')
+        self.assertEqual(mask_escape('a?,'), 'a??\\,')
+
+    def test_canonical_pools(self):
+        self.assertEqual(unique_tokens(['john', '', 'John', '', '123', '123']),
+                         ['john', 'John', '123'])
+        self.assertEqual(list(pair_tokens(['john', 'smith', 'John'])),
+                         ['john', 'johnsmith', 'smith', 'smithjohn', 'smithJohn',
+                          'John', 'Johnsmith'])
+        self.assertEqual(list(iter_date_tokens('', '')), [])
+
+    def test_profile_delta(self):
+        old = profile_pools(make_profile(birthdate='01021990'))
+        pools = profile_pools(make_profile(birthdate='01021990', pet='rex'))
+        merged = {key: unique_tokens(old[key] + tokens) for key, tokens in pools.items()}
+        delta = set(profile_delta(old, merged))
+        self.assertEqual(delta, profile_candidates(merged) - profile_candidates(old))
+        self.assertIn('rex2010', delta)
+        self.assertNotIn('john2010', delta)
+
+    def test_update_wordlist(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            prefix = os.path.join(tmp, 'john')
+            profile = make_profile(surname='smith')
+            self.assertEqual(update_wordlist(prefix, profile, profile_pools(profile)),
+                             prefix + '.txt')
+            profile = make_profile(surname='smith', pet='rex', leetmode=True)
+            self.assertEqual(update_wordlist(prefix, profile, profile_pools(profile)),
+                             prefix + '.delta.txt')
+            with open(prefix + '.txt') as f:
+                words = f.read().split()
+            with open(prefix + '.delta.txt') as f:
+                delta = f.read().split()
+            self.assertIn('rex2010', delta)
+            self.assertIn('j0hn5m17h', delta)
+            self.assertFalse(set(words) & set(delta))
+            with open(prefix + '.cupp.idx') as f:
+                self.assertEqual(f.read().split(), sorted(set(words + delta)))
+
+    def test_merge_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            index = os.path.join(tmp, 'idx')
+            with open(index, 'w') as f:
+                f.write('b\nd\n')
+            self.assertEqual(merge_index(index, ['a', 'b', 'c', 'e']), ['a', 'c', 'e'])
+            with open(index) as f:
+                self.assertEqual(f.read(), 'a\nb\nc\nd\ne\n')
+
+            delta = os.path.join(tmp, 'delta.txt')
+            self.assertEqual(merge_index(index, ['f'], delta), ['f'])
+            with open(delta) as f:
+                self.assertEqual(f.read(), 'f\n')
+            # The delta cannot be written: the index is left as it was
+            with self.assertRaises(OSError):
+                merge_index(index, ['g'], tmp)
+            with open(index) as f:
+                self.assertEqual(f.read(), 'a\nb\nc\nd\ne\nf\n')
+            self.assertEqual(sorted(os.listdir(tmp)), ['delta.txt', 'idx'])
+
+    def test_exclude_sorted(self):
+        words = ['a', 'b', 'c', 'd', 'e']
+        with tempfile.TemporaryDirectory() as tmp:
+            plain = os.path.join(tmp, 'plain.txt')
+            with open(plain, 'w') as f:
+                f.write('0\nb\nc\nz')
+            packed = os.path.join(tmp, 'packed.txt.gz')
+            with gzip.open(packed, 'wt') as f:
+                f.write('a\nd\n')
+            empty = os.path.join(tmp, 'empty.txt')
+            open(empty, 'w').close()
+            self.assertEqual(list(exclude_sorted(words, [plain])), ['a', 'd', 'e'])
+            self.assertEqual(list(exclude_sorted(words, [plain, packed, empty])), ['e'])
+
+    def test_wordlist_algebra(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            first = os.path.join(tmp, 'first.txt')
+            with open(first, 'w') as f:
+                f.write('d\nb\na\nb\n')  # not sorted, with duplicates
+            second = os.path.join(tmp, 'second.txt.gz')
+            with gzip.open(second, 'wt') as f:
+                f.write('b\r\nc\r\n')
+            files = [first, second]
+            self.assertEqual(list(wordlist_algebra('union', files)), [b'a', b'b', b'c', b'd'])
+            self.assertEqual(list(wordlist_algebra('intersect', files)), [b'b'])
+            self.assertEqual(list(wordlist_algebra('diff', files)), [b'a', b'd'])
+            self.assertEqual(list(sorted_wordlist(first, chunk=1)), [b'a', b'b', b'b', b'd'])
+
+            output = os.path.join(tmp, 'union.txt')
+            combine_wordlists('union', files, output)
+            with open(output) as f:
+                self.assertEqual(f.read().split(), ['a', 'b', 'c', 'd'])
+
+    def test_merge_stages_stats(self):
+        self.assertEqual(merge_stages([('a', ['x', 'y']), ('b', ['y', 'z'])]),
+                         {'x', 'y', 'z'})
+        start_profiling(stats=True)
+        try:
+            merge_stages([('a', ['abcdef', 'abc']), ('b', ['abc', 'abcdefg', 'abcdefg'])])
+            first, second = PROFILE['yield']
+            self.assertEqual((first['raw'], first['unique'], first['in_length']), (2, 2, 1))
+            self.assertEqual((second['raw'], second['unique'], second['in_length']), (3, 1, 1))
+            self.assertEqual(second['lengths'], {7: 1})
+        finally:
+            PROFILE.update({'enabled': False, 'stats': False})
+            tracemalloc.stop()
+
+    def test_compile_plan(self):
+        plan = compile_plan([('a', 'word x years'), ('b', 'off word x numbers'),
+                             ('c', 'on word | reverse | upper')], PROFILE_POOLS)
+        self.assertEqual(plan, (Stage('a', 'word', 'years', ()),
+                                Stage('c', 'word', None, ('reverse', 'upper'))))
+        self.assertEqual(run_plan(plan, {'word': ['test'], 'years': ['2010']}),
+                         [('a', ['test2010']), ('c', ['TSET'])])
+        with self.assertRaises(ValueError):
+            compile_plan([('a', 'word x nope')], PROFILE_POOLS)
+        with self.assertRaises(ValueError):
+            compile_plan([('a', 'word years')], PROFILE_POOLS)
+
+    def test_default_plan(self):
+        self.assertEqual(CONFIG['plan'], compile_plan(DEFAULT_PLAN, PROFILE_POOLS))
+        self.assertEqual(CONFIG['wordlist_plan'],
+                         compile_plan(DEFAULT_WORDLIST_PLAN, WORDLIST_POOLS))
+
+    def test_wordlist_writer(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'out.txt')
+            with WordlistWriter(filename, chunk=2) as writer:
+                writer.writelines(['a', 'b', 'c'])
+                writer.write('d')
+                writer.writelines(iter(['e']))
+                self.assertFalse(os.path.exists(filename))
+            self.assertEqual(writer.count, 5)
+            with open(filename) as f:
+                self.assertEqual(f.read(), os.linesep.join('abcde'))
+
+            with self.assertRaises(RuntimeError):
+                with WordlistWriter(filename) as writer:
+                    writer.write('new')
+                    raise RuntimeError
+            with open(filename) as f:
+                self.assertEqual(f.read(), os.linesep.join('abcde'))
+            self.assertEqual(os.listdir(tmp), ['out.txt'])
+
+    def test_word_arena(self):
+        words = ['pear', 'apple', 'ćevap', 'fig', 'apple', 'zebra', 'pear', 'Zoo']
+        arena = WordArena(words)
+        self.assertEqual(len(arena), 8)
+        self.assertEqual(list(arena), words)
+        arena.sort(run=3)
+        self.assertEqual(list(arena), sorted(words))
+        arena.sort(unique=True, run=3)
+        self.assertEqual(list(arena), sorted(set(words)))
+        arena.sort(unique=True)
+        self.assertEqual(list(arena), sorted(set(words)))
+        self.assertEqual(len(arena), 6)
+
+        arena.add_run('apple\nkiwi\nćevap\n'.encode())
+        self.assertEqual(list(arena), sorted(set(words) | {'kiwi'}))
+        arena = WordArena(['b', 'a'])
+        arena.add_run(b'c\nd\n')
+        self.assertEqual(list(arena), ['a', 'b', 'c', 'd'])
+        self.assertEqual(len(arena), 4)
+
+    def test_run_plan_parallel(self):
+        profile = make_profile(surname='smith', birthdate='01021990', pet='rex',
+                               randnum=True, leetmode=True)
+        pools = profile_pools(profile)
+        expected = set()
+        for word in merge_stages(run_plan(CONFIG['plan'], pools)):
+            expected.update([word, leet_replace(word)])
+        expected = sorted(word for word in expected
+                          if CONFIG['wcfrom'] < len(word) < CONFIG['wcto'])
+        self.assertGreater(len(list(plan_tasks(CONFIG['plan'], pools, size=100))),
+                           len(CONFIG['plan']))
+        arena = run_plan_parallel(CONFIG['plan'], pools, True, jobs=2)
+        self.assertEqual(list(arena), expected)
+
+    def test_leet_parallel(self):
+        words = {'password%i' % i for i in range(300)} | {'sesame', 'at', 'leet'}
+        expected = list(shape_words(set(words), True))
+        self.assertIn('p455w0rd12', expected)
+        self.assertEqual(list(leet_parallel(set(words), jobs=2, size=70)), expected)
+
+        leet = current_config()['leet']
+        self.assertEqual(leet_replacer()('password'), leet_replace('password'))
+        use_config(current_config().replace(leet=leet.replace(a='@e')))
+        self.assertEqual(leet_replacer()('password'), 'p@355w0rd')
+        self.assertEqual(leet_replace('password'), 'p@355w0rd')
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_numpy_candidates(self):
+        product = numpy_product(numpy, ['ab', 'c', 'def'], ['1', '22'])
+        self.assertEqual(sorted(product.tolist()),
+                         sorted([b'ab1', b'ab22', b'c1', b'c22', b'def1', b'def22']))
+        product = numpy_product(numpy, ['ab', 'c', 'def'], ['1', '22'], (2, 5))
+        self.assertEqual(sorted(product.tolist()), [b'ab1', b'ab22', b'c22', b'def1'])
+        self.assertEqual(len(numpy_product(numpy, ['ab'], [])), 0)
+
+        profile = make_profile(surname='smith', birthdate='01021990', pet='rex',
+                               randnum=True, spechars=True, leetmode=True)
+        pools = profile_pools(profile)
+        expected = set()
+        for word in profile_candidates(pools):
+            expected.update([word, leet_replace(word)])
+        expected = sorted(word for word in expected
+                          if CONFIG['wcfrom'] < len(word) < CONFIG['wcto'])
+        self.assertEqual(list(numpy_candidates(CONFIG['plan'], pools, True)), expected)
+        pools['pet'] = ['réx']
+        self.assertIsNone(numpy_candidates(CONFIG['plan'], pools, True))
+
+    def test_case_variants(self):
+        profile = make_profile(surname='smith', pet='rex')
+        self.assertEqual(profile_pools(profile)['cases'], [])
+
+        cases = Config(fields=('name', 'pet'), budget=3,
+                       variants=('upper', 'camel', 'toggle', 'alternate'))
+        use_config(current_config().replace(cases=cases))
+        self.assertEqual(list(case_variants(profile)),
+                         ['JOHN', 'johnRex', 'jOHN', 'REX', 'rexJohn', 'rEX'])
+        use_config(current_config().replace(cases=cases.replace(budget=1), wcto=5))
+        self.assertEqual(list(case_variants(profile, {'word': ['REX']})),
+                         ['JOHN', 'rEX'])
+
+    def test_config(self):
+        config = load_config()
+        self.assertEqual(config['years'], CONFIG['years'])
+        with self.assertRaises(AttributeError):
+            config.years = ()
+        with self.assertRaises(TypeError):
+            config['wcto'] = 20
+        other = config.replace(wcto=20)
+        self.assertEqual((config['wcto'], other['wcto']), (12, 20))
+        self.assertEqual(other['leet']['a'], LEET_CONFIG['a'])
+
+    def test_profiler_threads(self):
+        config = load_config()
+        profilers = [Profiler(config.replace(years=('1999',))),
+                     Profiler(config.replace(years=('2020',), leet=Config(o='0')))]
+        profile = make_profile(surname='smith', pet='rex', leetmode=True)
+        expected = [list(profiler.words(profile)) for profiler in profilers]
+        self.assertIn('john1999', expected[0])
+        self.assertIn('j0hn2020', expected[1])
+        self.assertNotIn('j0hn2020', expected[0])
+
+        results = [None] * 8
+        def generate(i):
+            results[i] = list(profilers[i % 2].words(profile))
+        threads = [threading.Thread(target=generate, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, expected * 4)
+        self.assertEqual(CONFIG['years'], config['years'])
+
+        improver = Improver(config.replace(years=('77',)))
+        self.assertIn('world77', list(improver.words(['hello world'])))
+
+    def test_profile_from_answers(self):
+        profile = profile_from_answers({'name': ' John ', 'words': 'hacker, juice',
+                                        'leetmode': 1})
+        self.assertEqual(profile, make_profile(words=['hacker', 'juice'], leetmode=True))
+        for answers in ({}, {'name': 'john', 'kidb': '123'}, {'name': 'john', 'age': 3},
+                        {'name': ['x']}, {'name': 'john', 'words': 7},
+                        {'name': 'john', 'words': [1, 2]}):
+            with self.assertRaises(ValueError):
+                profile_from_answers(answers)
+
+    def test_serve(self):
+        import json
+        import urllib.error
+        import urllib.request
+
+        server = make_server('127.0.0.1:0', workers=1)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:%i' % server.server_address[1]
+            def post(path, job):
+                request = urllib.request.Request(url + path, json.dumps(job).encode())
+                with urllib.request.urlopen(request) as response:
+                    self.assertEqual(response.headers['Transfer-Encoding'], 'chunked')
+                    return response.read().decode().splitlines()
+
+            job = {'name': 'john', 'surname': 'smith', 'leetmode': True}
+            expected = list(Profiler(current_config()).words(profile_from_answers(job)))
+            self.assertEqual(post('/profile', job), expected)
+            self.assertIn('hello2012', post('/wordlist', {'words': ['hello world']}))
+            with self.assertRaises(urllib.error.HTTPError) as error:
+                post('/profile', {'surname': 'smith'})
+            self.assertEqual(error.exception.code, 400)
+            for job in ({'words': 5}, {'words': [1, 2]}):
+                with self.assertRaises(urllib.error.HTTPError) as error:
+                    post('/wordlist', job)
+                self.assertEqual(error.exception.code, 400)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_policy(self):
+        self.assertIsNone(CONFIG['policy'])
+        self.assertEqual(char_classes('Ab1!'), {'lower', 'upper', 'digit', 'special'})
+        with self.assertRaises(ValueError):
+            compile_policy(classes=('symbols',))
+
+        config = current_config()
+        profile = make_profile(surname='smith', birthdate='01021990', pet='rex',
+                               words=['hacker'], spechars=True, randnum=True,
+                               leetmode=True)
+        full = list(Profiler(config).words(profile))
+        for policy in (compile_policy(8, 0, ('digit', 'upper')),
+                       compile_policy(classes=('special',), charset='johnsmitre!@#$0123'),
+                       compile_policy(7, 9)):
+            use_config(config.replace(policy=policy))
+            accept = word_filter()
+            self.assertEqual(list(Profiler(config.replace(policy=policy)).words(profile)),
+                             [word for word in full if accept(word)])
+        self.assertEqual(list(policy_komb(['ab', 'abcdef'], ['1', '12345'])),
+                         ['ab12345', 'abcdef1'])
+
+    def test_wordlist_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = WordlistCache(os.path.join(tmp, 'cache'), maxsize=10)
+            profile = make_profile(surname='smith')
+            key = cache.key('profile', profile, [])
+            self.assertEqual(key, cache.key('profile', dict(reversed(profile.items())), []))
+            self.assertNotEqual(key, cache.key('profile', make_profile(), []))
+            use_config(current_config().replace(years=('1999',)))
+            self.assertNotEqual(key, cache.key('profile', profile, []))
+
+            output = os.path.join(tmp, 'out.txt')
+            self.assertFalse(cache.fetch(key, output))
+            for time, (name, text) in enumerate((('a', 'abcdef'), ('b', 'ghi'), ('c', 'jklm'))):
+                with open(output, 'w') as f:
+                    f.write(text)
+                cache.store(name, output)
+                os.utime(cache.path(name), (time, time))
+            # a (6 bytes) was the least recently used: evicted for c
+            self.assertFalse(cache.fetch('a', output))
+            self.assertTrue(cache.fetch('b', output))
+            with open(output) as f:
+                self.assertEqual(f.read(), 'ghi')
+            self.assertEqual(sorted(os.listdir(cache.directory)), ['b.txt', 'c.txt'])
+
+    def test_manifest(self):
+        import hashlib
+        import json
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'out.txt')
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                count = Improver().generate(['hello world'], output, randnum=True)
+            self.assertEqual(stdout.getvalue(), '')
+            with open(output, 'rb') as f:
+                data = f.read()
+            with open(manifest_name(output)) as f:
+                manifest = json.load(f)
+            self.assertEqual(manifest['count'], count)
+            self.assertEqual(manifest['bytes'], len(data))
+            self.assertEqual(manifest['sha256'], hashlib.sha256(data).hexdigest())
+            lengths = collections.Counter(map(len, data.decode().split(os.linesep)))
+            self.assertEqual(manifest['lengths'], {str(n): c for n, c in lengths.items()})
+            self.assertTrue(manifest['params']['randnum'])
+            self.assertEqual(manifest['config']['wcto'], CONFIG['wcto'])
+            self.assertEqual(manifest['config']['sha256'], json_digest(current_config()))
+            self.assertNotIn('ftp', manifest['config'])
+            self.assertNotIn('spechars', manifest['config'])
+
+            cache = WordlistCache(os.path.join(tmp, 'cache'))
+            cache.store('key', output)
+            os.remove(manifest_name(output))
+            self.assertTrue(cache.fetch('key', output))
+            with open(manifest_name(output)) as f:
+                self.assertEqual(json.load(f), manifest)
+
+    def test_split_writer(self):
+        words = ['w%i' % i for i in range(1000)] + ['\xe9' * 5]
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'out.txt')
+            with SplitWriter(output, size=100, workers=2, chunk=7) as writer:
+                writer.writelines(words)
+            parts = []
+            for part in writer.parts:
+                with open(os.path.join(tmp, part['file']), 'rb') as f:
+                    parts.append(f.read())
+            self.assertTrue(all(len(part) <= 100 for part in parts))
+            self.assertEqual([len(part) for part in parts], [p['bytes'] for p in writer.parts])
+            self.assertEqual(os.linesep.encode().join(parts).decode().split(os.linesep), words)
+            self.assertEqual(writer.manifest()['count'], len(words))
+
+            with SplitWriter(output, lines=300, chunk=64) as writer:
+                writer.writelines(words)
+            self.assertEqual([part['count'] for part in writer.parts], [300, 300, 300, 101])
+            self.assertEqual(writer.parts[-1]['file'], 'out.0004.txt')
+
+            for name in os.listdir(tmp):
+                os.remove(os.path.join(tmp, name))
+            with self.assertRaises(ValueError):
+                with SplitWriter(output, lines=10) as writer:
+                    writer.writelines(words[:25])
+                    raise ValueError
+            self.assertEqual(sorted(os.listdir(tmp)), ['out.0001.txt', 'out.0002.txt'])
+
+    def test_main_usage_errors(self):
+        for options in (['-i', '-j', '-2'], ['-i', '--split-lines', '100', '--workers', '0'],
+                        ['-i', '--split-lines', '-3'], ['-i', '--split-size', '-1'],
+                        ['--serve', 'abc'], ['--serve', '8000', '--stats'],
+                        ['--serve', 'localhost:99999'], ['--serve', '0', '--profile']):
+            result = subprocess.run([sys.executable, 'cupp3.py', '-q'] + options,
+                                    stdin=subprocess.DEVNULL, capture_output=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)))
+            self.assertEqual(result.returncode, 2)
+            self.assertIn(b'usage:', result.stderr)
+
+    def test_plan_index(self):
+        profile = make_profile(surname='smith', birthdate='01021990', pet='rex',
+                               words=['hacker'], randnum=True, spechars=True,
+                               leetmode=True)
+        pools = profile_pools(profile)
+        full = set(Profiler().words(profile))
+        index = PlanIndex(CONFIG['plan'], pools, True)
+        probes = set(full) | {word + 'x' for word in full} | {word[1:] for word in full}
+        self.assertEqual({word for word in probes if word in index}, full)
+        self.assertEqual(index.query('john1990'), Match('komb1', 'john', '1990', False))
+        self.assertEqual(index.query('j0hn1990'), Match('komb1', 'john', '1990', True))
+        self.assertEqual(index.query('nhoj'), Match('reverse', 'nhoj', None, False))
+        self.assertIsNone(index.query('zzz'))
+
+        plan = compile_plan([('t1', 'kombinaa x years | title'),
+                             ('t2', 'word x numbers | reverse | upper')], PROFILE_POOLS)
+        index = PlanIndex(plan, pools)
+        words = set(itertools.chain.from_iterable(w for _, w in run_plan(plan, pools)))
+        self.assertIn('Johnsmith2010', words)
+        for word in words | {word.lower() for word in words}:
+            self.assertEqual(index.query(word) is not None, word in words)
+        self.assertEqual(index.query('21REKCAH'), Match('t2', 'hacker', '12', False))
+
+
 if __name__ == '__main__':
     unittest.main()